@@ -20,14 +20,16 @@ class ArrayExpandToken(tag.expand.AbstractExpandToken):
 	def parse(self, context):
 		(counter, content) = tag.expand.AbstractExpandToken.parse(self, context)
 
-		if not hasattr(context, 'arraysyntax'):
+		arraysyntax = context.settings.arraysyntax
+
+		if arraysyntax is None:
 			raise Exception("[[...]] array expansion used without a previously defined @arraysyntax")
-		elif context.arraysyntax == 'C':
+		elif arraysyntax == 'C':
 			# C array indexing goes backwards!
 			(counter.start, counter.end, counter.stride) = (counter.end, counter.start, -1)
 			return iteration.IterationBlock(counter, content, formatstring = '[%s]')
 
-		elif context.arraysyntax == 'F':
+		elif arraysyntax == 'F':
 			return iteration.IterationBlock(counter, content, before = '(', between = ',', after = ')')
 			
 		
@@ -0,0 +1,115 @@
+import os
+import sys
+import multiprocessing
+import parser
+import codegen
+import diskcache
+import digests
+import library
+from cStringIO import StringIO
+
+'''
+Builds many .grx files in one run, for use from make
+
+build() takes a list of (input file, output file) pairs, which read_manifest() can read from a file. A file is only
+rendered again if its input, or grx itself, has changed since the output was last written, which is worked out from
+the SHA-1 of each recorded in the disk cache (see diskcache.py) along with that of every file it includes, and the
+output is only written if its content has changed, so that its timestamp only moves when something downstream
+actually needs rebuilding.
+'''
+
+# Return a list of (input file, output file) pairs from a manifest with one pair on each line, separated by whitespace,
+# where paths are relative to the directory of the manifest and # starts a comment
+def read_manifest(path):
+	directory = os.path.dirname(path)
+	pairs = []
+	with open(path) as f:
+		for (number, line) in enumerate(f):
+			line = line.split('#', 1)[0].strip()
+			if line == '':
+				continue
+
+			files = line.split()
+			if len(files) != 2:
+				raise ValueError(path + ':' + str(number + 1) + ': expected an input and an output file')
+			pairs.append((os.path.join(directory, files[0]), os.path.join(directory, files[1])))
+	return pairs
+
+
+# Build each pair with jobs processes, report on stderr and return the number of files which failed
+def build(pairs, jobs = 1):
+	if jobs == 1:
+		results = [build_file(pair) for pair in pairs]
+	else:
+		pool = multiprocessing.Pool(jobs)
+		try:
+			results = pool.map(build_file, pairs, 1)
+			pool.close()
+		finally:
+			pool.terminate()
+			pool.join()
+
+	counts = {}
+	failed = 0
+	for ((infile, outfile), (status, message)) in zip(pairs, results):
+		counts[status] = counts.get(status, 0) + 1
+		if status == 'failed':
+			failed = failed + 1
+			print >> sys.stderr, infile + ': ' + message
+
+	print >> sys.stderr, 'grx: %d files, %d written, %d unchanged, %d up to date, %d failed' % (len(pairs),
+		counts.get('written', 0), counts.get('unchanged', 0), counts.get('cached', 0), failed)
+	return failed
+
+
+# Bring outfile up to date with infile, return (status, error message) where status is cached if nothing had to be
+# done, unchanged if the file was rendered again with the same result, written or failed
+def build_file(pair):
+	(infile, outfile) = pair
+	try:
+		with open(infile) as f:
+			source = f.read()
+
+		key = [os.path.abspath(infile), os.path.abspath(outfile)]
+		inputs = {'grx': digests.version(), key[0]: digests.digest(source)}
+
+		entry = None
+		if diskcache.disk is not None:
+			entry = diskcache.disk.get('batch', key)
+		if entry is not None and current(entry['inputs'], inputs) and entry['output'] == digests.file_digest(outfile):
+			return ('cached', None)
+
+		includes = library.Includes(os.path.dirname(key[0]))
+		output = codegen.render(StringIO(source), settings = parser.Settings(includes = includes)) + '\n'
+		inputs.update(includes.files)
+
+		if digests.digest(output) == digests.file_digest(outfile):
+			status = 'unchanged'
+		else:
+			write(outfile, output)
+			status = 'written'
+
+		if diskcache.disk is not None:
+			diskcache.disk.put('batch', key, {'inputs': inputs, 'output': digests.digest(output)})
+		return (status, None)
+
+	except Exception, e:
+		return ('failed', parser.error_message(e))
+
+
+# Whether the inputs recorded when a file was last built are the same as now, given the digests of those already
+# known in inputs, where any others are files it included
+def current(recorded, inputs):
+	for (name, value) in recorded.iteritems():
+		if (inputs[name] if name in inputs else digests.file_digest(name)) != value:
+			return False
+	return all([name in recorded for name in inputs])
+
+
+# Replace the content of path, via a temporary file so that a failed write doesn't leave half a file behind
+def write(path, string):
+	temporary = path + '.grx-tmp'
+	with open(temporary, 'w') as f:
+		f.write(string)
+	os.rename(temporary, path)
+
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codegen
+
+'''
+Compares the C compiler's time on a kernel using tensor symmetries written with @definescope and @definescope[[replace]]
+
+	python bench/definescope.py [largest number of dimensions]
+
+The kernel computes Christoffel symbols and a contraction of them, with symmetric metric and Christoffel components
+brought back to the ones computed with @define. With the default @definescope these are #define and #undef lines
+which the preprocessor expands, with [[replace]] grx writes the canonical names in their place. For each number of
+dimensions the output is written to a file and run through the preprocessor alone and through the whole compiler,
+$CC or cc, with $CFLAGS, by default -O1. The comparison is skipped when there is no compiler.
+'''
+
+template = '''@defaultrange[[1,%(dim)d]]
+void kernel(const double *restrict in, double *restrict out)
+{
+@definescope%(mode)s
+@iterate[[i, j=i..]]
+	const double g`i`j` = *in++;
+	@define[[g`j`i`, g`i`j`]]
+@end
+@iterate[[i, j=i.., k]]
+	const double dg`i`j`k` = *in++;
+	@define[[dg`j`i`k`, dg`i`j`k`]]
+@end
+@iterate[[i, j, k=j..]]
+	const double Gamma`i`j`k` = 0.5 * (@sum[[l]] g`i`l` * (dg`j`l`k` + dg`k`l`j` - dg`j`k`l`) @end);
+	@define[[Gamma`i`k`j`, Gamma`i`j`k`]]
+@end
+@iterate[[i, j]]
+	*out++ = @sum[[k]] @sum[[l]] Gamma`k`i`l` * Gamma`l`j`k` - Gamma`k`k`l` * Gamma`l`i`j` @end @end;
+@end
+@end[[definescope]]
+}
+'''
+
+modes = [('pragma', ''), ('replace', '[[replace]]')]
+
+
+# The time taken by the command, or None if it couldn't be run
+def run(command):
+	start = time.time()
+	try:
+		with open(os.devnull, 'w') as null:
+			status = subprocess.call(command, stdout = null)
+	except OSError:
+		return None
+	if status != 0:
+		raise Exception(' '.join(command) + ' failed')
+	return time.time() - start
+
+def main(argv):
+	largest = int(argv[1]) if len(argv) > 1 else 7
+	compiler = os.environ.get('CC', 'cc')
+	flags = os.environ.get('CFLAGS', '-O1').split()
+
+	directory = tempfile.mkdtemp()
+	try:
+		print '%4s %-8s %10s %10s %10s %10s' % ('dim', 'mode', 'bytes', 'defines', 'cpp s', 'cc s')
+		for dim in range(3, largest + 1):
+			for (name, mode) in modes:
+				output = codegen.render(StringIO(template % {'dim': dim, 'mode': mode}))
+				path = os.path.join(directory, 'kernel_%d_%s.c' % (dim, name))
+				with open(path, 'w') as f:
+					f.write(output)
+
+				cpp = run([compiler, '-E', path])
+				cc = run([compiler] + flags + ['-c', path, '-o', path + '.o'])
+				print '%4d %-8s %10d %10d %10s %10s' % (dim, name, len(output), output.count('#define'),
+					'%.3f' % cpp if cpp is not None else '-', '%.3f' % cc if cc is not None else '-')
+
+		if cpp is None:
+			print 'no compiler found, set $CC to time the preprocessor and compiler'
+	finally:
+		shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	main(sys.argv)
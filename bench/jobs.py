@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import subprocess
+import multiprocessing
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''
+Times grx.py rendering a large template serially and with --jobs, see parallel.py
+
+	python bench/jobs.py [number of dimensions] [largest number of jobs]
+
+The template computes every component of the Riemann tensor from Christoffel symbols and their derivatives, in a top
+level @iterate whose counter values are shared out between the processes, followed by the Ricci tensor in a block of
+its own. It is rendered with 1, 2, 4, ... jobs, by default up to the number of processors here, and the speed-up over
+rendering it serially is printed along with a check that the output is the same. The same is then done with the whole
+template inside a @definescope, which is a single top level block and so is rendered by one process whatever --jobs
+is.
+'''
+
+template = '''@defaultrange[[1,%(dim)d]]
+@arraysyntax[[C]]
+@stencil[[d1]]
+	@derivative[[ 1, 4 ]]
+@end
+%(open)s
+@iterate[[i, j, k, l]]
+	const double R`i`j`k`l` = @d1[[ Gamma`i`j`l`[[x#]], k, d1 ]] - @d1[[ Gamma`i`j`k`[[x#]], l, d1 ]]
+		+ @sum[[m]] Gamma`i`k`m`[[x#]] * Gamma`m`j`l`[[x#]] - Gamma`i`l`m`[[x#]] * Gamma`m`j`k`[[x#]] @end;
+@end
+@iterate[[i, j=i..]]
+	const double Ric`i`j` = @sum[[k]] R`k`i`k`j` @end;
+@end
+%(close)s
+'''
+
+# The template as it is, and inside a @definescope
+layouts = [('top level', '', ''), ('definescope', '@definescope', '@end[[definescope]]')]
+
+
+def grx(options, source):
+	argv = [sys.executable, os.path.join(root, 'grx.py'), '--no-cache'] + options + ['-']
+	start = time.time()
+	process = subprocess.Popen(argv, stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+	output = process.communicate(source)[0]
+	if process.returncode != 0:
+		raise Exception(' '.join(argv) + ' failed')
+	return (output, time.time() - start)
+
+def main(argv):
+	dim = int(argv[1]) if len(argv) > 1 else 6
+	largest = int(argv[2]) if len(argv) > 2 else multiprocessing.cpu_count()
+
+	for (name, start, end) in layouts:
+		source = template % {'dim': dim, 'open': start, 'close': end}
+		(expected, serial) = grx([], source)
+		print '%s: %d dimensions, %d bytes of output, %d processors' % (name, dim, len(expected),
+			multiprocessing.cpu_count())
+		print '%6s %9s %9s %5s' % ('jobs', 's', 'speed-up', 'same')
+		print '%6s %9.3f %9.2f %5s' % ('serial', serial, 1., 'yes')
+		jobs = 1
+		while jobs <= largest:
+			(output, seconds) = grx(['--jobs=%d' % jobs], source)
+			print '%6d %9.3f %9.2f %5s' % (jobs, seconds, serial / seconds, 'yes' if output == expected else 'NO')
+			jobs = jobs * 2
+		print
+
+
+if __name__ == '__main__':
+	main(sys.argv)
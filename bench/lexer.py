@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lexer
+
+'''
+Times lexer.lex() and lexer.lex_stream() on inputs of growing size, to check that lexing is linear in their length
+
+	python bench/lexer.py [largest size in KB]
+
+The time per KB should stay about the same as the input grows, for a template of many small blocks, for one long run
+of plain text, which the old lexer built a character at a time, and for a single block spanning the whole input, which
+lex_stream() can't write out until it has read all of it. Each input is lexed a few times and the fastest is kept.
+'''
+
+# A top level block with tags, nested arguments, array expansions and a long run of text
+piece = '''@iterate[[i, j=i..]]
+	const double dd`i`j` = @d2[[ f[[x#]], i, j, d1cen4, d2cen4 ]] / (dx * dx); /* ''' + 'a long comment ' * 20 + '''*/
+	g`i`j`[[x#]] = @sum[[k]] ginv`i`k` * dg`k`j` @end;
+@end
+'''
+
+# Each input as a function of its size in bytes
+inputs = [
+	('blocks', lambda size: piece * (size / len(piece) + 1)),
+	('text', lambda size: 'double x = y * z; ' * (size / 18 + 1)),
+	('one block', lambda size: '@definescope\n' + piece * (size / len(piece) + 1) + '@end[[definescope]]\n'),
+]
+
+
+def best(function, repeat = 3):
+	times = []
+	for i in range(repeat):
+		start = time.time()
+		function()
+		times.append(time.time() - start)
+	return min(times)
+
+def main(argv):
+	largest = int(argv[1]) if len(argv) > 1 else 4096
+
+	print '%-10s %8s %10s %10s %14s %14s' % ('input', 'KB', 'lex s', 'stream s', 'lex us/KB', 'stream us/KB')
+	for (name, generate) in inputs:
+		size = 16
+		while size <= largest:
+			source = generate(size * 1024)
+			kb = len(source) / 1024.
+			lex = best(lambda: lexer.lex(source))
+			stream = best(lambda: list(lexer.lex_stream(StringIO(source))))
+			print '%-10s %8d %10.4f %10.4f %14.1f %14.1f' % (name, kb, lex, stream, lex / kb * 1e6, stream / kb * 1e6)
+			size = size * 4
+
+
+if __name__ == '__main__':
+	main(sys.argv)
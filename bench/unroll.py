@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codegen
+
+'''
+Compares a kernel of second derivatives with wide stencils emitted unrolled and as loops, see @unroll and looped.py
+
+	python bench/unroll.py [largest number of dimensions] [order of the stencils]
+
+For each number of dimensions the kernel takes every second derivative of a grid function at every interior point,
+once with every derivative unrolled and once with those of more than 16 terms emitted as loops. It prints the size of
+the generated code, the time grx takes to render it, the time the compiler, $CC or cc with $CFLAGS (by default -O2),
+takes to build it and the time the program takes to run, and checks that both give the same result. The compiler
+columns are left out when there is no compiler.
+'''
+
+template = '''@defaultrange[[1,%(dim)d]]
+@arraysyntax[[C]]
+@stencil[[d1]]
+	@derivative[[ 1, %(order)d ]]
+@end
+@stencil[[d2]]
+	@derivative[[ 2, %(order)d ]]
+@end
+@unroll[[%(limit)s]]
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#define N %(size)d
+#define G %(ghosts)d
+
+double kernel(const double *restrict data)
+{
+	const double (*f)%(strides)s = (const double (*)%(strides)s) data;
+	double total = 0.;
+	@rexpand[[ for (int x# = G; x# < N - G; x#++) { ]]
+		double s = 0.;
+	@iterate[[i, j=i..]]
+		s += @d2[[ f[[x#]], i, j, d1, d2 ]];
+	@end
+		total += s * s;
+	@expand[[ } ]]
+	return total;
+}
+
+int main(void)
+{
+	long points = 1;
+	for (int i = 0; i < %(dim)d; i++)
+		points *= N;
+	double *data = malloc(points * sizeof(double));
+	for (long n = 0; n < points; n++)
+		data[n] = (double) ((n * 7919) %% 1000) / 1000.;
+	clock_t start = clock();
+	double total = 0.;
+	for (int repeat = 0; repeat < %(repeat)d; repeat++)
+		total += kernel(data);
+	printf("%%.17g %%f\\n", total, (double) (clock() - start) / CLOCKS_PER_SEC);
+	free(data);
+	return 0;
+}
+'''
+
+# The most terms of a derivative which is still unrolled
+limits = [('unrolled', 'all'), ('looped', '16')]
+
+
+# Run command, return its standard output and the time it took, or None if it couldn't be run
+def run(command):
+	start = time.time()
+	try:
+		process = subprocess.Popen(command, stdout = subprocess.PIPE)
+	except OSError:
+		return None
+	output = process.communicate()[0]
+	if process.returncode != 0:
+		raise Exception(' '.join(command) + ' failed')
+	return (output, time.time() - start)
+
+def main(argv):
+	largest = int(argv[1]) if len(argv) > 1 else 4
+	order = int(argv[2]) if len(argv) > 2 else 8
+	compiler = os.environ.get('CC', 'cc')
+	flags = os.environ.get('CFLAGS', '-O2').split()
+
+	directory = tempfile.mkdtemp()
+	try:
+		print '%4s %-9s %10s %9s %9s %9s' % ('dim', 'emitted', 'bytes', 'grx s', 'cc s', 'run s')
+		for dim in range(2, largest + 1):
+			# about a million points
+			size = int(round(1e6 ** (1. / dim)))
+			results = []
+			for (name, limit) in limits:
+				source = template % {'dim': dim, 'order': order, 'limit': limit, 'size': size, 'ghosts': order / 2,
+					'strides': '[N]' * (dim - 1), 'repeat': 3}
+				start = time.time()
+				output = codegen.render(StringIO(source))
+				rendering = time.time() - start
+
+				path = os.path.join(directory, 'kernel_%d_%s' % (dim, name))
+				with open(path + '.c', 'w') as f:
+					f.write(output)
+
+				built = run([compiler, '-std=gnu99'] + flags + [path + '.c', '-o', path])
+				if built is None:
+					print '%4d %-9s %10d %9.3f %9s %9s' % (dim, name, len(output), rendering, '-', '-')
+					continue
+				(total, seconds) = run([path])[0].split()
+				results.append(float(total))
+				print '%4d %-9s %10d %9.3f %9.3f %9.3f' % (dim, name, len(output), rendering, built[1], float(seconds))
+
+			if len(results) == 2 and abs(results[0] - results[1]) > 1e-9 * abs(results[0]):
+				print 'the unrolled and looped kernels differ: %r, %r' % tuple(results)
+	finally:
+		shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	main(sys.argv)
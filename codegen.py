@@ -0,0 +1,244 @@
+import __builtin__
+import lexer
+import parser
+from cStringIO import StringIO
+
+'''
+Compiles a parsed block tree into a Python function which renders it
+
+Every block class can implement compile(gen), emitting Python statements through the CodeGenerator below.
+Iteration counters become local variables of the generated function and @iterate-style blocks become plain
+for-loops, so rendering no longer walks the tree. Blocks which don't know how to compile themselves are called
+through the tree-walking interpreter instead, so the output is always the same as block.write(out, frame).
+'''
+
+# Python refuses to compile more than 20 statically nested loops, so deeper nests are moved into helper functions
+max_loop_depth = 16
+
+
+def compile(block):
+	return CompiledBlock(block)
+
+
+# Render the document read from the file-like infile into out if given, otherwise return the output as a string. Each
+# top level block is compiled as soon as it has been parsed, or its tree is walked if compiled is False. memo and
+# report are as for parser.AbstractBlock.render(), settings are the parser.Settings to start parsing with
+def render(infile, out = None, memo = None, report = None, compiled = True, settings = None):
+	if out is None:
+		out = StringIO()
+		render(infile, out, memo, report, compiled, settings)
+		return out.getvalue()
+
+	for block in parser.parse_stream(lexer.lex_stream(infile), settings):
+		if compiled:
+			block = compile(block)
+		block.render(out, memo, report)
+
+
+class CompiledBlock(parser.AbstractBlock):
+
+	def __init__(self, block):
+		self.block = block
+		self._functions = {}
+
+	# Renders with and without a memo run different code, see invariant.MemoBlock
+	def generate(self, memoize):
+		gen = CodeGenerator(memoize)
+		gen.function(self.block)
+
+		namespace = {'_k': gen.constants, 'StringIO': StringIO}
+		self.source = gen.source()
+		exec __builtin__.compile(self.source, '<grx>', 'exec') in namespace
+		self._functions[memoize] = namespace[gen.functions[0]]
+
+	def write(self, out, frame):
+		memoize = frame.memo is not None
+		if memoize not in self._functions:
+			self.generate(memoize)
+		self._functions[memoize](out, frame)
+
+
+class CodeGenerator(object):
+
+	def __init__(self, memoize = False):
+		self.memoize = memoize
+
+		self.constants = []
+		self._constant_index = {}
+
+		self.functions = []
+		self._lines = []
+
+		self._names = 0
+
+		self._body = []
+		self._prologue = []
+		self._indent = 0
+		self._blockstarts = []
+		self._bindings = {}
+		self._writers = []
+		self._pending = []
+		self._loop_depth = 0
+
+	# A fresh local variable name
+	def newname(self, prefix = '_v'):
+		self._names = self._names + 1
+		return prefix + str(self._names)
+
+	# The expression referring to obj from within generated code
+	def constant(self, obj):
+		key = id(obj)
+		if key not in self._constant_index:
+			self._constant_index[key] = len(self.constants)
+			self.constants.append(obj)
+		return '_k[' + str(self._constant_index[key]) + ']'
+
+	def source(self):
+		return '\n'.join(self._lines) + '\n'
+
+
+	# Generate a new function which renders block, with the currently bound variables passed in as arguments
+	# Return the function name
+	def function(self, block, bindings = None):
+		name = self.newname('_f')
+		self.functions.append(name)
+
+		# helper functions are generated while the current one is only half done
+		saved = (self._body, self._prologue, self._indent, self._blockstarts, self._bindings, self._writers, self._pending, self._loop_depth)
+
+		self._body = []
+		self._prologue = []
+		self._indent = 1
+		self._blockstarts = []
+		self._bindings = dict(bindings or {})
+		self._pending = []
+		self._loop_depth = 0
+
+		out = self.newname('_out')
+		self._writers = [(out, self.newname('_w'))]
+
+		arguments = [out, '_frame'] + sorted(name for (obj, name) in self._bindings.itervalues())
+		self.statement(self._writers[-1][1] + ' = ' + out + '.write')
+		block.compile(self)
+		self.flush()
+
+		self._lines.append('def ' + name + '(' + ', '.join(arguments) + '):')
+		self._lines.extend(self._prologue)
+		self._lines.extend(self._body)
+		self._lines.append('')
+
+		(self._body, self._prologue, self._indent, self._blockstarts, self._bindings, self._writers, self._pending, self._loop_depth) = saved
+
+		return name
+
+
+	# Emit a line of code at the current indentation
+	def statement(self, line):
+		self.flush()
+		self._body.append('\t' * self._indent + line)
+
+	# Emit a line of code at the start of the current function, e.g. to initialise a variable used across loop iterations
+	def prologue(self, line):
+		self._prologue.append('\t' + line)
+
+	# Start the body of a compound statement
+	def indent(self):
+		self.flush()
+		self._indent = self._indent + 1
+		self._blockstarts.append(len(self._body))
+
+	def dedent(self):
+		self.flush()
+		if self._blockstarts.pop() == len(self._body):
+			self.statement('pass')
+		self._indent = self._indent - 1
+
+
+	# Write a constant string, merging it with any adjacent ones
+	def literal(self, string):
+		if len(string) > 0:
+			self._pending.append(string)
+
+	# Write the string which expression evaluates to
+	def write(self, expression):
+		self.statement(self.writer() + '(' + expression + ')')
+
+	def flush(self):
+		if len(self._pending) > 0:
+			string = ''.join(self._pending)
+			self._pending = []
+			self._body.append('\t' * self._indent + self.writer() + '(' + repr(string) + ')')
+
+	def writer(self):
+		return self._writers[-1][1]
+
+	def output(self):
+		return self._writers[-1][0]
+
+	# The render frame, see parser.AbstractBlock
+	def frame(self):
+		return '_frame'
+
+
+	# Render block into a string instead of the current output, return the name of the variable holding it
+	def capture(self, block):
+		buf = self.newname('_b')
+		self.statement(buf + ' = StringIO()')
+		self.flush()
+		self._writers.append((buf, self.newname('_w')))
+		self.statement(self.writer() + ' = ' + buf + '.write')
+		block.compile(self)
+		self.flush()
+		self._writers.pop()
+
+		string = self.newname('_s')
+		self.statement(string + ' = ' + buf + '.getvalue()')
+		return string
+
+
+	# Make obj available to generated code as a local variable, return its name
+	def bind(self, obj, prefix = '_v'):
+		name = self.newname(prefix)
+		self._bindings[id(obj)] = (obj, name)
+		return name
+
+	def unbind(self, obj):
+		del self._bindings[id(obj)]
+
+	def lookup(self, obj):
+		try:
+			return self._bindings[id(obj)][1]
+		except KeyError:
+			return None
+
+
+	# Whether a block which opens another loop should go into a helper() instead
+	def too_deep(self):
+		return self._loop_depth >= max_loop_depth
+
+	def begin_loop(self, line):
+		self.statement(line)
+		self.indent()
+		self._loop_depth = self._loop_depth + 1
+
+	def end_loop(self):
+		self.dedent()
+		self._loop_depth = self._loop_depth - 1
+
+	# Render block in a helper function which receives the local variables bound so far
+	def helper(self, block):
+		self.flush()
+		name = self.function(block, self._bindings)
+		arguments = [self.output(), self.frame()] + sorted(name for (obj, name) in self._bindings.itervalues())
+		self.statement(name + '(' + ', '.join(arguments) + ')')
+
+
+	# Let the interpreter render block, after handing it the current values of the bound variables
+	def fallback(self, block):
+		self.store_bindings()
+		self.statement(self.constant(block) + '.write(' + self.output() + ', ' + self.frame() + ')')
+
+	# Copy the values of the bound variables into the frame, for code which reads them from there
+	def store_bindings(self):
+		for (obj, name) in self._bindings.values():
+			obj.compile_store(self, name)
@@ -0,0 +1,34 @@
+import os
+import glob
+import hashlib
+
+'''
+Digests of strings, of files and of grx itself, which the disk cache (see diskcache.py) uses to tell whether what an
+entry was computed from has changed
+'''
+
+def digest(string):
+	return hashlib.sha1(string).hexdigest()
+
+# The digest of the content of path, or None if it can't be read
+def file_digest(path):
+	try:
+		with open(path) as f:
+			return digest(f.read())
+	except IOError:
+		return None
+
+
+_version = None
+
+# A digest of the source of grx itself, which changes whenever anything that could change the output does
+def version():
+	global _version
+	if _version is None:
+		directory = os.path.dirname(os.path.abspath(__file__))
+		sha = hashlib.sha1()
+		for path in sorted(glob.glob(os.path.join(directory, '*.py')) + glob.glob(os.path.join(directory, 'tag', '*.py'))):
+			with open(path) as f:
+				sha.update(os.path.basename(path) + '\0' + f.read() + '\0')
+		_version = sha.hexdigest()
+	return _version
@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+import tempfile
+
+'''
+Values worth keeping from one run of grx to the next, stored as one JSON file per entry in a directory
+
+Entries are looked up by a namespace, naming what kind of value they hold, and a key made of JSON values. The cache
+is only ever an optimisation: an entry which can't be read, or a directory which can't be written, simply means the
+value is computed again. Each entry is written to a temporary file first and then renamed into place, so several
+runs can share the directory. A write which fails removes its temporary file and stops the cache from writing for
+the rest of the run, so a read-only or sandboxed directory costs one failed attempt and leaves nothing behind.
+'''
+class DiskCache(object):
+
+	def __init__(self, directory):
+		self.directory = directory
+		# False once a write has failed
+		self.writable = True
+
+	def path(self, namespace, key):
+		digest = hashlib.sha1(json.dumps(key, sort_keys = True)).hexdigest()
+		return os.path.join(self.directory, namespace, digest + '.json')
+
+	# Return the value stored under key, or None
+	def get(self, namespace, key):
+		try:
+			with open(self.path(namespace, key)) as f:
+				entry = json.load(f)
+		except (IOError, OSError, ValueError):
+			return None
+
+		# compare the keys themselves in case of a hash collision, going through JSON to turn tuples into lists
+		if not isinstance(entry, dict) or entry.get('key') != json.loads(json.dumps(key)):
+			return None
+		return entry.get('value')
+
+	def put(self, namespace, key, value):
+		if not self.writable:
+			return
+
+		path = self.path(namespace, key)
+		directory = os.path.dirname(path)
+		temporary = None
+		try:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+
+			(fd, temporary) = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+			with os.fdopen(fd, 'w') as f:
+				json.dump({'key': key, 'value': value}, f)
+			os.rename(temporary, path)
+		except (IOError, OSError):
+			self.writable = False
+		finally:
+			# still there if anything failed before the rename
+			if temporary is not None and os.path.lexists(temporary):
+				try:
+					os.remove(temporary)
+				except OSError:
+					pass
+
+
+# The directory named by $GRX_CACHE, or grx in $XDG_CACHE_HOME or ~/.cache, None if there is no home directory
+def default_directory():
+	directory = os.environ.get('GRX_CACHE')
+	if directory:
+		return directory
+
+	cache = os.environ.get('XDG_CACHE_HOME')
+	if not cache or not os.path.isabs(cache):
+		home = os.path.expanduser('~')
+		if not os.path.isabs(home):
+			return None
+		cache = os.path.join(home, '.cache')
+	return os.path.join(cache, 'grx')
+
+# A DiskCache in default_directory(), None if there isn't one
+def default():
+	directory = default_directory()
+	if directory is None:
+		return None
+	return DiskCache(directory)
+
+
+# The cache shared by everything in this run, None if caching on disk has been turned off
+disk = default()
@@ -0,0 +1,73 @@
+from fractions import Fraction
+import diskcache
+
+'''
+Finite difference weights from Fornberg's algorithm, in exact rational arithmetic
+
+weights(order, points) returns the weight of each point in the approximation of the derivative of the given order at
+zero, for a unit grid spacing. Results are kept in memory for the rest of the run and in the disk cache for later
+ones, see diskcache.py.
+'''
+
+_weights = {}
+
+# Bump when the way weights are computed changes, so that older entries on disk aren't used
+_version = 1
+
+def weights(order, points):
+	points = tuple([Fraction(point) for point in points])
+	key = (order, points)
+
+	if key not in _weights:
+		disk_key = [_version, order, [str(point) for point in points]]
+		stored = None
+		if diskcache.disk is not None:
+			stored = diskcache.disk.get('fornberg', disk_key)
+
+		if stored is not None:
+			_weights[key] = [Fraction(weight) for weight in stored]
+		else:
+			_weights[key] = compute(order, points)
+			if diskcache.disk is not None:
+				diskcache.disk.put('fornberg', disk_key, [str(weight) for weight in _weights[key]])
+
+	return list(_weights[key])
+
+
+def compute(order, points):
+	if order < 0:
+		raise ValueError("the order of a derivative can't be negative")
+	if len(points) <= order:
+		raise ValueError("a derivative of order " + str(order) + " needs at least " + str(order + 1) + " points")
+	if len(set(points)) != len(points):
+		raise ValueError("the points of a stencil must be distinct")
+
+	n = len(points)
+	# c[k][j] is the weight of points[j] in the derivative of order k, using the points up to the current one
+	c = [[Fraction(0)] * n for k in range(order + 1)]
+	c[0][0] = Fraction(1)
+	c1 = Fraction(1)
+	c4 = points[0]
+
+	for i in range(1, n):
+		mn = min(i, order)
+		c2 = Fraction(1)
+		c5 = c4
+		c4 = points[i]
+
+		for j in range(i):
+			c3 = points[i] - points[j]
+			c2 = c2 * c3
+
+			if j == i - 1:
+				for k in range(mn, 0, -1):
+					c[k][i] = c1 * (k * c[k - 1][i - 1] - c5 * c[k][i - 1]) / c2
+				c[0][i] = -c1 * c5 * c[0][i - 1] / c2
+
+			for k in range(mn, 0, -1):
+				c[k][j] = (c4 * c[k][j] - k * c[k - 1][j]) / c3
+			c[0][j] = c4 * c[0][j] / c3
+
+		c1 = c2
+
+	return c[order]
@@ -1,7 +1,17 @@
+import os
 import traceback
 import sys
 import lexer
 import parser
+import codegen
+import memo
+import diskcache
+import looped
+import parallel
+import batch
+import watch
+import library
+import server
 
 '''
 TODO: Change all exceptions raised by the lexer/parser to be of type GrxError
@@ -10,18 +20,118 @@ class GrxError(Exception):
 	pass
 
 
-if len(sys.argv) == 1:
-	print "Usage: " + sys.argv[0].strip() + " [input file] > [output file]"
+# Run grx with the command line argv, writing to sys.stdout and sys.stderr, and return the exit status
+def main(argv):
+	options = [arg for arg in argv[1:] if arg.startswith('--')]
+	arguments = [arg for arg in argv[1:] if not arg.startswith('--')]
+
+	building = '--batch' in options or '--watch' in options or any(option.startswith('--manifest=') for option in options)
+	serving = any(option == '--serve' or option.startswith('--serve=') for option in options)
+
+	if not serving and (len(arguments) % 2 != 0 if building else len(arguments) != 1):
+		print "Usage: " + argv[0].strip() + " [--memoize[=entries]] [--no-cache] [--report] [--jobs=N] [input file] > [output file]"
+		print "       " + argv[0].strip() + " [--no-cache] [--jobs=N] --batch [input file] [output file] ..."
+		print "       " + argv[0].strip() + " [--no-cache] [--jobs=N] --manifest=[file]"
+		print "       " + argv[0].strip() + " [--no-cache] --watch [input file] [output file] ..."
+		print "       " + argv[0].strip() + " --serve[=socket] [library file] ..."
+		print "Use - as the input file to read from stdin"
+		print "--memoize caches repeated parts of the output and reports hit rates on stderr"
+		print "--no-cache doesn't keep generated stencils in $GRX_CACHE (by default $XDG_CACHE_HOME/grx or ~/.cache/grx)"
+		print "           for later runs"
+		print "--report lists on stderr whether each derivative was unrolled or emitted as a loop, see @unroll"
+		print "--jobs renders the top level blocks, and the values of a top level @iterate, on N processes"
+		print "--batch builds each input file into the output file after it, skipping those which are up to date"
+		print "--manifest reads the pairs of input and output files from a file, one pair on each line"
+		print "--watch keeps the output files up to date as the input files change, until interrupted"
+		print "--serve answers grxc.py on a Unix socket, by default $GRX_SOCKET or grx.sock in $GRX_CACHE, with the"
+		print "        library files given already loaded for @include"
+		return 0
 
-else:
 	try:
-		tokens = lexer.lex(open(sys.argv[1]).read())
-		blocks = parser.parse(tokens)
-		print blocks.execute()
+		cache = None
+		report = None
+		jobs = 1
+		pairs = zip(arguments[0::2], arguments[1::2]) if building else None
+		for option in options:
+			if option == '--memoize':
+				cache = memo.Memo()
+			elif option.startswith('--memoize='):
+				try:
+					cache = memo.Memo(int(option[len('--memoize='):]))
+				except ValueError:
+					raise GrxError("invalid memo size in " + option)
+			elif option == '--no-cache':
+				diskcache.disk = None
+			elif option == '--report':
+				report = looped.Report()
+			elif option.startswith('--jobs='):
+				try:
+					jobs = int(option[len('--jobs='):])
+					if jobs < 1:
+						raise ValueError
+				except ValueError:
+					raise GrxError("invalid number of jobs in " + option)
+			elif option == '--batch' or option == '--watch' or option == '--serve' or option.startswith('--serve='):
+				pass
+			elif option.startswith('--manifest='):
+				try:
+					pairs.extend(batch.read_manifest(option[len('--manifest='):]))
+				except IOError, e:
+					raise GrxError("can't read manifest: " + str(e))
+			else:
+				raise GrxError("unknown option " + option)
+
+		if serving:
+			if len(options) != 1:
+				raise GrxError("--serve can't be used with other options")
+			server.serve(options[0][len('--serve='):] or None, arguments, main)
+			return 0
+
+		if building:
+			if cache is not None or report is not None:
+				raise GrxError("--memoize and --report can't be used with --batch, --manifest or --watch")
+			if '--watch' in options:
+				if jobs != 1:
+					raise GrxError("--jobs can't be used with --watch")
+				watch.watch(pairs)
+				return 0
+			if batch.build(pairs, jobs) > 0:
+				return 1
+			return 0
+
+		if arguments[0] == '-':
+			infile = sys.stdin
+			settings = parser.Settings(includes = library.Includes())
+		else:
+			infile = open(arguments[0])
+			settings = parser.Settings(includes = library.Includes(os.path.dirname(os.path.abspath(arguments[0]))))
+
+		# Each top level block is compiled and written out as soon as it has been parsed, unless they are shared out
+		# between several processes once the whole document has been parsed
+		if jobs == 1:
+			codegen.render(infile, sys.stdout, cache, report, settings = settings)
+		else:
+			blocks = list(parser.parse_stream(lexer.lex_stream(infile), settings))
+			parallel.render(blocks, sys.stdout, jobs, cache, report)
+		sys.stdout.write('\n')
+
+		if cache is not None:
+			print >> sys.stderr, cache.stats()
+		if report is not None:
+			for line in report.lines():
+				print >> sys.stderr, line
 
 	except Exception, e:
+		sys.stdout.flush()
 		if not parser.verbose_error:
-			print e.message 
+			print >> sys.stderr, parser.error_message(e)
 		else:
-			print traceback.format_exc()
-			raise e
\ No newline at end of file
+			print >> sys.stderr, traceback.format_exc()
+			raise e
+		return 1
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import socket
+import struct
+
+'''
+Runs grx.py by asking a server started with grx.py --serve, which takes the same command line
+
+The files named on the command line are read and written by the server, in the same directory as the client. When no
+server is listening on the socket, or for --watch and --serve, grx.py is run here instead. This only imports what it
+needs to talk to the server, see server.py, since starting it is all the time a request has to itself.
+'''
+
+# The environment variables passed on to the server
+environ = ['GRX_CACHE', 'XDG_CACHE_HOME', 'HOME']
+
+
+# Run the command line argv on the server and return its exit status
+def main(argv):
+	options = [arg for arg in argv[1:] if arg.startswith('--')]
+	if '--watch' in options or any(option == '--serve' or option.startswith('--serve=') for option in options):
+		local(argv)
+
+	try:
+		client = connect(default_path())
+	except socket.error:
+		local(argv)
+
+	request = {
+		'argv': argv,
+		'cwd': os.getcwd(),
+		'environ': dict([(name, os.environ[name]) for name in environ if name in os.environ]),
+	}
+	client.sendall(json.dumps(request) + '\n')
+
+	# the input is sent alongside reading the output, which the server may start to send before it has read all of it
+	if '-' in argv[1:]:
+		import threading
+		sender = threading.Thread(target = send, args = (client, sys.stdin))
+		sender.daemon = True
+		sender.start()
+	else:
+		client.shutdown(socket.SHUT_WR)
+
+	stream = client.makefile('rb')
+	while True:
+		frame = read_frame(stream)
+		if frame is None:
+			print >> sys.stderr, 'grx: the server stopped before finishing'
+			return 1
+
+		(channel, data) = frame
+		if channel == 'o':
+			sys.stdout.write(data)
+		elif channel == 'e':
+			sys.stderr.write(data)
+		else:
+			sys.stdout.flush()
+			return int(data)
+
+
+# Send everything in stream to the server, then the end of the input
+def send(client, stream, chunk_size = 65536):
+	try:
+		while True:
+			chunk = stream.read(chunk_size)
+			if chunk == '':
+				break
+			client.sendall(chunk)
+		client.shutdown(socket.SHUT_WR)
+	except socket.error:
+		# the server has stopped reading, and will say why
+		pass
+
+
+# The path of the socket, $GRX_SOCKET or grx.sock in the directory of the disk cache, or in the temporary directory
+# if there is no home directory
+def default_path():
+	path = os.environ.get('GRX_SOCKET')
+	if not path:
+		import diskcache
+		directory = diskcache.default_directory()
+		if directory is None:
+			import tempfile
+			return os.path.join(tempfile.gettempdir(), 'grx-%d.sock' % os.getuid())
+		path = os.path.join(directory, 'grx.sock')
+	return path
+
+
+def connect(path):
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	client.connect(path)
+	return client
+
+
+# Return the next (channel, data) sent by Output to stream, or None at the end
+def read_frame(stream):
+	header = read_exactly(stream, 5)
+	if header is None:
+		return None
+	(channel, size) = struct.unpack('!cI', header)
+	data = read_exactly(stream, size)
+	if data is None:
+		return None
+	return (channel, data)
+
+def read_exactly(stream, size):
+	data = stream.read(size)
+	if len(data) < size:
+		return None
+	return data
+
+
+# Replace this process with grx.py itself
+def local(argv):
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grx.py')
+	sys.stdout.flush()
+	os.execv(sys.executable, [sys.executable, script] + argv[1:])
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
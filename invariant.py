@@ -0,0 +1,127 @@
+import parser
+
+'''
+Loop-invariant hoisting and memoization
+
+Every block reports the variables it reads while rendering (iteration counters and stencil points) through
+dependencies(). Blocks which repeat their content, like IterationBlock and the derivative blocks, pass it through
+hoist() when they are created: the parts of the content which don't read the loop's own variables are wrapped in an
+InvariantBlock, which only renders them again once the variables they do read have changed, and otherwise repeats
+the previous output. A @d1 of a field indexed only by an outer counter is thus rendered once for each value of that
+counter, rather than once for every iteration of the loops inside it.
+
+The remaining parts whose dependencies are known are wrapped in a MemoBlock. These render as usual, unless the render
+was given a memo.Memo, in which case their output is looked up there by the values of the variables they read.
+'''
+
+# Return block, with the parts which don't read any of variables wrapped in InvariantBlocks
+def hoist(block, variables):
+	if not expensive(block):
+		return block
+
+	dependencies = block.dependencies()
+	if dependencies is not None and dependencies.isdisjoint(variables):
+		return InvariantBlock(block, dependencies)
+
+	if isinstance(block, parser.BlockSequence):
+		return parser.BlockSequence([hoist(child, variables) for child in block.blocks])
+
+	if dependencies is not None:
+		return MemoBlock(block, dependencies)
+
+	return block
+
+
+# Whether rendering block does more than write out a few strings and numbers
+def expensive(block):
+	if isinstance(block, parser.BlockSequence):
+		return any(expensive(child) for child in block.blocks)
+	else:
+		return isinstance(block, parser.AbstractBlock) and not block.trivial
+
+
+class MemoBlock(parser.AbstractBlock):
+
+	def __init__(self, block, dependencies):
+		self.block = block
+		self.variables = sorted(dependencies, key = lambda variable: variable.slot)
+
+	def dependencies(self):
+		return frozenset(self.variables)
+
+	# The values of the variables read by the block
+	def values(self, frame):
+		return tuple([frame[variable.slot] for variable in self.variables])
+
+	# Render the block into a string, or look it up in the memo of this render if there is one
+	def evaluate(self, frame, values):
+		memo = frame.memo
+		if memo is None:
+			return self.block.execute(frame)
+
+		key = (self.block, values)
+		string = memo.get(key)
+		if string is None:
+			string = self.block.execute(frame)
+			memo.put(key, string)
+		return string
+
+	def write(self, out, frame):
+		if frame.memo is None:
+			self.block.write(out, frame)
+		else:
+			out.write(self.evaluate(frame, self.values(frame)))
+
+	def compile(self, gen):
+		if gen.memoize:
+			gen.write(self.compile_evaluate(gen, self.compile_values(gen)))
+		else:
+			self.block.compile(gen)
+
+	# Python expression for values() in generated code
+	def compile_values(self, gen):
+		values = [variable.compile_value(gen) for variable in self.variables]
+		return '(' + ''.join([value + ', ' for value in values]) + ')'
+
+	# Emit code for evaluate(), return the name of the variable holding the string
+	def compile_evaluate(self, gen, values):
+		if not gen.memoize:
+			return gen.capture(self.block)
+
+		key = gen.newname('_q')
+		string = gen.newname('_s')
+		gen.statement('%s = (%s, %s)' % (key, gen.constant(self.block), values))
+		gen.statement('%s = %s.memo.get(%s)' % (string, gen.frame(), key))
+		gen.statement('if %s is None:' % string)
+		gen.indent()
+		gen.statement('%s = %s' % (string, gen.capture(self.block)))
+		gen.statement('%s.memo.put(%s, %s)' % (gen.frame(), key, string))
+		gen.dedent()
+		return string
+
+
+class InvariantBlock(MemoBlock):
+
+	# The last output is kept in the frame under this block, along with the values of the variables it was rendered for
+	def write(self, out, frame):
+		values = self.values(frame)
+		cached = frame.get(self)
+
+		if cached is None or cached[0] != values:
+			cached = (values, self.evaluate(frame, values))
+			frame[self] = cached
+
+		out.write(cached[1])
+
+	def compile(self, gen):
+		values = gen.newname('_h')
+		string = gen.newname('_h')
+		gen.prologue('%s = %s = None' % (values, string))
+
+		current = self.compile_values(gen)
+		gen.statement('if %s != %s:' % (values, current))
+		gen.indent()
+		gen.statement('%s = %s' % (values, current))
+		gen.statement('%s = %s' % (string, self.compile_evaluate(gen, values)))
+		gen.dedent()
+		gen.write(string)
@@ -2,68 +2,122 @@ import parser
 import text
 import re
 import num
+import invariant
 
 # Produces <before> <content_0> [<content_i> <between>] <content_n> <after>
 class IterationBlock(parser.AbstractBlock):
 
+	# Whether the values of the counter have to be rendered in order in one frame, because a @pointscope in the content
+	# numbers its temporaries on from one value to the next, see parallel.chunks()
+	ordered = False
+
 	def __init__(self, counter, content, before = '', between = '', after = '', formatstring = '%s'):
 		self.counter = counter
-		self.content = content
+		self.set_content(content)
 
 		self.before = text.blockify(before)
 		self.between = text.blockify(between)
 		self.after = text.blockify(after)
 
 		self.formatstring = formatstring
+		(self._prefix, self._suffix) = formatstring.split('%s')
+
+	# self.body is what is actually rendered for each value of the counter, see invariant.py
+	def set_content(self, content):
+		self.content = content
+		self.body = invariant.hoist(content, [self.counter])
+
+	def dependencies(self):
+		counter = self.counter
+		dependencies = parser.dependencies([counter.start, counter.end, self.before, self.content, self.between, self.after])
+		if dependencies is None:
+			return None
+		else:
+			return dependencies - frozenset([counter])
+
+	def write(self, out, frame):
+		self.before.write(out, frame)
+		self.write_values(out, frame, self.counter.values(frame))
+		self.after.write(out, frame)
+
+	# Write the output for some of the values of the counter, without before and after, rendering the body with body
+	# if given, e.g. a compiled version of it
+	def write_values(self, out, frame, values, body = None):
+		if body is None:
+			body = self.body
+
+		counter = self.counter
+		end = counter.end.numvalue(frame)
 
-	def execute(self):
-		output = ''
+		for value in values:
+			frame[counter.slot] = value
 
-		output = output + self.before.execute()
+			out.write(self._prefix)
+			body.write(out, frame)
+			out.write(self._suffix)
 
-		for i in self.counter:
-			output = output + (self.formatstring % self.content.execute())
+			if value < end:
+				self.between.write(out, frame)
 
-			if self.counter.hasnext():
-				output = output + self.between.execute()
+	def compile(self, gen):
+		if gen.too_deep():
+			gen.helper(self)
+			return
 
-		output = output + self.after.execute()
-		return output
+		self.before.compile(gen)
 
+		counter = self.counter
+		end = counter.end.compile_value(gen)
+		name = gen.bind(counter, '_i')
+
+		gen.begin_loop('for %s in xrange(%s, %s + %d, %d):' % (name, counter.start.compile_value(gen), end, counter.stride, counter.stride))
+		gen.literal(self._prefix)
+		self.body.compile(gen)
+		gen.literal(self._suffix)
+
+		if not (isinstance(self.between, text.TextBlock) and self.between.content == ''):
+			gen.statement('if %s < %s:' % (name, end))
+			gen.indent()
+			self.between.compile(gen)
+			gen.dedent()
+
+		gen.end_loop()
+		gen.unbind(counter)
+
+		self.after.compile(gen)
+
+# The current value of a counter is kept in the render frame, under the slot it was declared with
 class IterationCounter(num.AbstractNumber):
 
 	def __init__(self, start, end, stride = 1):
-		self.active = False
-
 		self.start = start
 		self.end = end
 
 		self.stride = stride
+		self.slot = None
 
-	def numvalue(self):
-		return self._value
+	def dependencies(self):
+		return frozenset([self])
 
-	def __iter__(self):
-		if self.active:
-			raise Exception(repr(self) + " this iteration counter is already active")
-		else:
-			self.active = True
-			self._value = self.start.numvalue() - self.stride
-			return self
+	def numvalue(self, frame):
+		return frame[self.slot]
+
+	# The values taken by the counter, in order
+	def values(self, frame):
+		return xrange(self.start.numvalue(frame), self.end.numvalue(frame) + self.stride, self.stride)
 
-	def hasnext(self):
-		return self._value < self.end.numvalue()
+	def execute(self, frame):
+		return str(frame[self.slot])
 
-	def next(self):
-		self._value = self._value + self.stride
-		if (self.stride > 0 and self._value <= self.end.numvalue()) or (self.stride < 0 and self._value >= self.end.numvalue()):
-			return self._value
+	def compile_value(self, gen):
+		name = gen.lookup(self)
+		if name is None:
+			return '%s[%d]' % (gen.frame(), self.slot)
 		else:
-			self.active = False
-			raise StopIteration
+			return name
 
-	def execute(self):
-		return str(self._value)
+	def compile_store(self, gen, name):
+		gen.statement('%s[%d] = %s' % (gen.frame(), self.slot, name))
 
 
 class RangeSpecContext(text.PlainStringContext):
@@ -88,20 +142,18 @@ class RangeSpecContext(text.PlainStringContext):
 			start = num.fromstring(m.group(2), context)
 		else:
 			# no start value, try default
-			try:
-				start = context.defaultrange[0]
-			except AttributeError:
+			if context.settings.defaultrange is None:
 				raise Exception("range start value omitted, but no @defaultrange defined")
+			start = context.settings.defaultrange[0]
 		
 
 		if m.group(3) is not None:
 			end = num.fromstring(m.group(3), context)
 		else:
 			# no end value, try default
-			try:
-				end = context.defaultrange[1]
-			except ValueError:
+			if context.settings.defaultrange is None:
 				raise Exception("range end value omitted, but no @defaultrange defined")
+			end = context.settings.defaultrange[1]
 
 
 		return RangeSpec(name, IterationCounter(start, end))
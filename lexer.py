@@ -5,6 +5,11 @@ def lex(string):
 	return lexer.lex()
 
 
+# Lex a file object incrementally, yielding top level tokens as soon as they are complete
+def lex_stream(stream, chunk_size = 65536):
+	return StreamLexer(stream, chunk_size).tokens()
+
+
 class AbstractToken(object):
 	pass
 
@@ -36,299 +41,325 @@ class TokenSequence(AbstractToken):
 			token.print_debug()
 
 
+class LexerError(Exception):
+	pass
+
+
+'''
+Raised when the input runs out inside an array expansion or @tag argument list
+The outermost unfinished construct replaces the message with its own, so that
+the error points at the bracket which was never closed
+'''
+class UnexpectedEnd(Exception):
+	pass
+
+
+'''
+The lexer never walks the input one character at a time: it jumps between the
+characters that matter to the current state with compiled regexes, and every
+token is built by slicing the input. Line and column numbers are worked out
+from string offsets only when a token is created.
+
+Array expansions and @tag arguments are lexed in place by recursing into
+lex_tokens() on the same buffer, so the input is scanned exactly once no matter
+how deeply these constructs are nested.
+'''
 class Lexer(object):
 
-	class State(object):
-		TEXT = 0
-		TAG = 1
-		ARRAYEXPAND = 2
+	# Characters which may end a run of plain text, depending on where the text is
+	text_special = re.compile(r"[@\[]")
+	nested_special = re.compile(r"[@\[\]]")
+	nested_comma_special = re.compile(r"[@\[\],]")
 
-	def __init__(self, string, start_line, start_char):
+	# Match only [a-zA-Z0-9_] for a tag name
+	tagname = re.compile(r"\w*")
+
+	def __init__(self, string, start_line = 1, start_char = 1):
 		self.string = string
 		self.start_line = start_line
 		self.start_char = start_char
 
+		# whether self.string holds everything up to the end of the input
+		self.eof = True
+
 
 	def reset(self):
-		self.chars_read = 0
-		self.state = Lexer.State.TEXT
-		self.tokens = []
+		self.pos = 0
 
-		self.char = ''
-		self.line_number = self.start_line
-		self.char_pos = self.start_char
-		self.advance()
+		# cache for position(), which is normally called with increasing offsets
+		self._pos_offset = 0
+		self._pos_line = self.start_line
+		self._pos_linestart = -1
 
 
-	def advance(self):
-		if self.chars_read < len(self.string):
-			if self.char == '\n':
-				self.line_number = self.line_number + 1
-				self.char_pos = 1
-			elif self.char != '':
-				self.char_pos = self.char_pos + 1
+	# Return the (line, char) of the character at offset in self.string
+	def position(self, offset):
 
-			self.char = self.string[self.chars_read]
-			self.chars_read = self.chars_read + 1
+		# running off the end reports the position of the last character
+		if offset >= len(self.string):
+			offset = len(self.string) - 1
+		if offset < 0:
+			return (self.start_line, self.start_char)
 
-		else:
-			self.char = None
+		if offset < self._pos_offset:
+			self._pos_offset = 0
+			self._pos_line = self.start_line
+			self._pos_linestart = -1
 
-		return self
+		newlines = self.string.count('\n', self._pos_offset, offset)
+		if newlines > 0:
+			self._pos_line = self._pos_line + newlines
+			self._pos_linestart = self.string.rfind('\n', self._pos_offset, offset)
+		self._pos_offset = offset
 
-
-	def append_token(self, token):
-		self.tokens.append(token)
+		if self._pos_linestart < 0:
+			return (self._pos_line, self.start_char + offset)
+		else:
+			return (self._pos_line, offset - self._pos_linestart)
 
 
 	def lex(lexer):
 		lexer.reset()
-		while lexer.char is not None:
-			if lexer.state == Lexer.State.TEXT:
-				lexer.lex_text()
-			elif lexer.state == Lexer.State.ARRAYEXPAND:
-				lexer.lex_arrayexpand()
-			elif lexer.state == Lexer.State.TAG:
-				lexer.lex_tag()
-		return TokenSequence(lexer.tokens)
+		try:
+			(tokens, closed_by) = lexer.lex_tokens()
+		except UnexpectedEnd, e:
+			raise LexerError(e.message)
+		return TokenSequence(tokens)
 
 
-	# Lex an inert blob of text
-	def lex_text(lexer):
+	class Close(object):
+		EOF = 0
+		BRACKETS = 1
+		COMMA = 2
 
-		string = ''
 
-		start_line = lexer.line_number
-		start_char = lexer.char_pos
+	# Called when the input runs out: this is an error for nested constructs, but the end of the document at the top level
+	def running_out(lexer, nested):
+		if nested or not lexer.eof:
+			raise UnexpectedEnd
 
-		class InnerState(object):
-			READ = 0
-			OPENBRACKET_WAIT = 1
-			DONE = 2
 
-		inner_state = InnerState.READ
+	# Lex tokens starting from lexer.pos
+	# At the top level this runs to the end of the input. When nested, it stops at (and consumes) the first ]] or, if split is set, the first comma
+	# Return the list of tokens and what stopped the lexer
+	def lex_tokens(lexer, nested = False, split = False):
+		tokens = []
+		closed_by = None
+		while closed_by is None:
+			closed_by = lexer.lex_step(tokens, nested, split)
+		return (tokens, closed_by)
 
-		while (inner_state != InnerState.DONE) and (lexer.char is not None):
 
-			if inner_state == InnerState.READ:
+	# Lex a run of text and the tag or array expansion which follows it, appending them to tokens
+	# Return what stopped the lexer, or None if there is more to read
+	def lex_step(lexer, tokens, nested = False, split = False):
 
-				if lexer.char == '[':
-					inner_state = InnerState.OPENBRACKET_WAIT
-				elif lexer.char == '@':
-					inner_state = InnerState.DONE
-					lexer.state = Lexer.State.TAG
-				else:
-					string = string + lexer.char
+		from text import TextToken
 
-			elif inner_state == InnerState.OPENBRACKET_WAIT:
+		string = lexer.string
+		length = len(string)
 
-				if lexer.char == '[':
-					inner_state = InnerState.DONE
-					lexer.state = Lexer.State.ARRAYEXPAND
-				elif lexer.char == '@':
-					string = string + '['
-					inner_state = InnerState.DONE
-					lexer.state = Lexer.State.TAG
+		if not nested:
+			special = Lexer.text_special
+		elif split:
+			special = Lexer.nested_comma_special
+		else:
+			special = Lexer.nested_special
+
+		start = pos = lexer.pos
+		end = None
+		next_state = None
+		closed_by = None
+
+		while end is None:
+			m = special.search(string, pos)
+			if m is None:
+				lexer.running_out(nested)
+				end = pos = length
+				closed_by = Lexer.Close.EOF
+				break
+
+			i = m.start()
+			c = string[i]
+
+			if c == '@':
+				end = i
+				pos = i + 1
+				next_state = lexer.lex_tag
+
+			elif c == ',':
+				end = i
+				pos = i + 1
+				closed_by = Lexer.Close.COMMA
+
+			elif i + 1 >= length:
+				lexer.running_out(nested)
+				# a lone [ at the very end of the input is dropped
+				end = i
+				pos = length
+				closed_by = Lexer.Close.EOF
+
+			elif c == ']':
+				if string[i + 1] == ']':
+					end = i
+					pos = i + 2
+					closed_by = Lexer.Close.BRACKETS
 				else:
-					string = string + '[' + lexer.char
-					inner_state = InnerState.READ
-			
-			lexer.advance()
-
-		if len(string) > 0:
-			from text import TextToken
-			lexer.append_token(TextToken(start_line, start_char, string))
-
+					pos = i + 1
 
-	# Lex an array expansion directive
-	def lex_arrayexpand(lexer):
+			elif string[i + 1] == '[':
+				end = i
+				pos = i + 2
+				next_state = lexer.lex_arrayexpand
 
-		string = ''
+			elif string[i + 1] == '@':
+				end = i + 1
+				pos = i + 2
+				next_state = lexer.lex_tag
 
-		line_number = lexer.line_number
-		char_pos = lexer.char_pos
-
-		class InnerState(object):
-			READ = 0
-			OPENBRACKET_WAIT = 1
-			CLOSEBRACKET_WAIT = 2
-			DONE = 3
-
-		inner_state = InnerState.READ
-		opencount = 0
+			else:
+				# [ followed by anything else is plain text
+				pos = i + 2
 
-		while (inner_state != InnerState.DONE):
+		if next_state is not None and pos >= length:
+			# a trailing @ or [[ at the very end of the input is dropped
+			lexer.running_out(nested)
+			closed_by = Lexer.Close.EOF
 
-			if lexer.char is None:
-				raise Exception('Error: ' + str(line_number) + ':' + str(char_pos - 2) + ': missing a closing ]]')
+		if end > start:
+			(line, char) = lexer.position(start)
+			tokens.append(TextToken(line, char, string[start:end]))
 
-			if inner_state == InnerState.READ:
+		lexer.pos = pos
 
-				if lexer.char == '[':
-					inner_state = InnerState.OPENBRACKET_WAIT
-				elif lexer.char == ']':
-					inner_state = InnerState.CLOSEBRACKET_WAIT
-				else:
-					string = string + lexer.char
+		if closed_by is None:
+			# an @ at the very end of an argument is dropped as well
+			if next_state == lexer.lex_tag and nested and (string.startswith(']]', pos) or (split and string[pos] == ',')):
+				pass
+			else:
+				tokens.append(next_state(nested))
 
-			elif inner_state == InnerState.OPENBRACKET_WAIT:
+		return closed_by
 
-				if lexer.char == '[':
-					opencount = opencount + 1
 
-				string = string + '[' + lexer.char
-				inner_state = InnerState.READ
+	# Lex an array expansion directive, starting just after the [[
+	def lex_arrayexpand(lexer, nested):
 
-			elif inner_state == InnerState.CLOSEBRACKET_WAIT:
+		(line_number, char_pos) = lexer.position(lexer.pos)
 
-				if lexer.char == ']':
-					if opencount > 0:
-						string = string + ']]'
-						opencount = opencount - 1
-						inner_state = InnerState.READ
-					else:
-						inner_state = InnerState.DONE
-				else:
-					string = string + ']' + lexer.char
-					inner_state = InnerState.READ
+		try:
+			(inner_tokens, closed_by) = lexer.lex_tokens(nested = True)
+		except UnexpectedEnd:
+			raise UnexpectedEnd('Error: ' + str(line_number) + ':' + str(char_pos - 2) + ': missing a closing ]]')
 
-			lexer.advance()
-		
-		# Process the expansion string as if it were a separate GRX document
 		from arrayexpand import ArrayExpandToken
-		inner_tokens = Lexer(string, start_line = line_number, start_char = char_pos).lex()
-		lexer.append_token(ArrayExpandToken(line_number, char_pos - 2, inner_tokens))
-		lexer.state = Lexer.State.TEXT
+		return ArrayExpandToken(line_number, char_pos - 2, TokenSequence(inner_tokens))
 
 
-	# Lex an @tag
-	def lex_tag(lexer):
+	# Lex an @tag, starting just after the @
+	def lex_tag(lexer, nested):
 
 		import tag
 
-		name = ''
-		args = []
-
-		line_number = lexer.line_number
-		char_pos = lexer.char_pos
-
-		class InnerState(object):
-			READ = 0
-			OPENBRACKET_WAIT = 1
-			DONE = 2
-
-		inner_state = InnerState.READ
-
-		# Match only [a-zA-Z0-9_] for a tag name
-		tagname = re.compile(r"\w")
-
-
-		while (inner_state != InnerState.DONE) and (lexer.char is not None):
-
-			if inner_state == InnerState.READ:
-				if tagname.match(lexer.char):
-					name = name + lexer.char
-					lexer.advance()
-				elif lexer.char == '[':
-					inner_state = InnerState.OPENBRACKET_WAIT
-					lexer.advance()
-				else:
-					inner_state = InnerState.DONE
-
-			elif inner_state == InnerState.OPENBRACKET_WAIT:
-				if lexer.char == '[':
-					args = lexer.advance().lex_tag_args(split = tag.token_class(name)._lexer_split_args())
-					inner_state = InnerState.DONE
-				else:
-					# This should be safe here. But don't try this elsewhere!
-					lexer.char = '['
-					lexer.chars_read = lexer.chars_read - 1
-					lexer.char_pos = lexer.char_pos - 1
+		string = lexer.string
+		length = len(string)
 
-					inner_state = InnerState.DONE
-			
-		
-		lexer.append_token(tag.create_token(line_number, char_pos - 1, name, args))
-		lexer.state = Lexer.State.TEXT
-
-
-	# Lex arguments list for an @tag
-	def lex_tag_args(lexer, split = True):
+		(line_number, char_pos) = lexer.position(lexer.pos)
 
+		m = Lexer.tagname.match(string, lexer.pos)
+		name = m.group(0)
+		lexer.pos = m.end()
 		args = []
 
-		string = ''
-		opencount = 0
+		if lexer.pos >= length:
+			lexer.running_out(nested)
 
-		start_line = lexer.line_number
-		start_char = lexer.char_pos
+		elif string[lexer.pos] == '[':
+			if lexer.pos + 1 >= length:
+				lexer.running_out(nested)
+				# a lone [ at the very end of the input is dropped
+				lexer.pos = length
 
-		arg_line = lexer.line_number
-		arg_char = lexer.char_pos
+			elif string[lexer.pos + 1] == '[':
+				lexer.pos = lexer.pos + 2
+				args = lexer.lex_tag_args(split = tag.token_class(name)._lexer_split_args())
 
-		class InnerState(object):
-			READ = 0
-			OPENBRACKET_WAIT = 1
-			CLOSEBRACKET_WAIT = 2
-			DONE = 3
+		return tag.create_token(line_number, char_pos - 1, name, args)
 
-		inner_state = InnerState.READ
 
-		while (inner_state != InnerState.DONE):
+	# Lex arguments list for an @tag, starting just after the [[
+	def lex_tag_args(lexer, split = True):
 
-			if not lexer.char:
-				raise Exception('Error: ' + str(start_line) + ':' + str(start_char - 1) + ': @tag argument list is missing a closing ]')
+		(start_line, start_char) = lexer.position(lexer.pos)
 
-			param_fully_read = False
+		args = []
+		closed_by = Lexer.Close.COMMA
 
-			if inner_state == InnerState.READ:
+		try:
+			while closed_by == Lexer.Close.COMMA:
+				(inner_tokens, closed_by) = lexer.lex_tokens(nested = True, split = split)
+				args.append(TokenSequence(inner_tokens))
+		except UnexpectedEnd:
+			raise UnexpectedEnd('Error: ' + str(start_line) + ':' + str(start_char - 1) + ': @tag argument list is missing a closing ]')
 
-				if lexer.char == '[':
-					inner_state = InnerState.OPENBRACKET_WAIT
-				elif lexer.char == ']':
-					inner_state = InnerState.CLOSEBRACKET_WAIT
-				elif split and (lexer.char == ',') and (opencount == 0):
-					param_fully_read = True
-				else:
-					string = string + lexer.char
-
-			elif inner_state == InnerState.OPENBRACKET_WAIT:
-
-				if lexer.char == '[':
-					opencount = opencount + 1
-				
-				string = string + '[' + lexer.char
-				inner_state = InnerState.READ
-
-			elif inner_state == InnerState.CLOSEBRACKET_WAIT:
-
-				if lexer.char == ']':
-					if opencount > 0:
-						opencount = opencount - 1
-						string = string + ']]'
-						inner_state = InnerState.READ
-					else:
-						param_fully_read = True
-						inner_state = InnerState.DONE
-				else:
-					string = string + ']' + lexer.char
-					inner_state = InnerState.READ
-
-			if param_fully_read:
+		return args
 
-				# Process each complete argument string as if it were a separate GRX document
-				inner_tokens = Lexer(string, start_line = arg_line, start_char = arg_char).lex()
-				args.append(inner_tokens)
-				
-				# Start a new argument string
-				string = ''
-				lexer.advance()
-				arg_line = lexer.line_number
-				arg_char = lexer.char_pos
 
+'''
+Lexes a file object (e.g. sys.stdin) without reading all of it into memory
+Only the text from the start of the current top level token onwards is kept,
+so the buffer never grows much beyond the largest single token
+'''
+class StreamLexer(Lexer):
+
+	def __init__(self, stream, chunk_size = 65536):
+		Lexer.__init__(self, '', start_line = 1, start_char = 1)
+		self.stream = stream
+		self.chunk_size = chunk_size
+		self.eof = False
+		self.reset()
+
+	# Read another chunk, discarding everything before the current position
+	def read_more(self):
+
+		consumed = self.pos
+		if consumed > 0:
+			newlines = self.string.count('\n', 0, consumed)
+			if newlines > 0:
+				self.start_line = self.start_line + newlines
+				self.start_char = consumed - self.string.rfind('\n', 0, consumed)
 			else:
-				# Keep reading into the current argument string
-				lexer.advance()
+				self.start_char = self.start_char + consumed
+			self.string = self.string[consumed:]
 
-		return args
+		# read at least as much as we already hold, so that retrying a long token stays linear
+		chunk = self.stream.read(max(self.chunk_size, len(self.string)))
+		if len(chunk) == 0:
+			self.eof = True
+		else:
+			self.string = self.string + chunk
+
+		self.reset()
+
+	def tokens(self):
+		self.read_more()
+
+		while True:
+			start = self.pos
+			tokens = []
+			try:
+				closed_by = self.lex_step(tokens)
+			except UnexpectedEnd, e:
+				if self.eof:
+					raise LexerError(e.message)
+				# the token is incomplete, start again from its beginning once there is more input
+				self.pos = start
+				self.read_more()
+				continue
+
+			for token in tokens:
+				yield token
+
+			if closed_by == Lexer.Close.EOF:
+				return
 
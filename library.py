@@ -0,0 +1,183 @@
+import os
+import lexer
+import parser
+import codegen
+import num
+import diskcache
+import digests
+from cStringIO import StringIO
+
+'''
+Documents brought in with @include, parsed once per process and kept by path
+
+A library is parsed as a document of its own. What it leaves behind at its end, the variables it declared (e.g. with
+@stencil and @defaultrange), the settings it changed (@defaultrange, @arraysyntax and @unroll) and the text it
+rendered, is kept as a Library for every @include of the same file to apply to its own context. The Library is only
+parsed again once the file, or a file it includes, has a different modification time or size. A library which only
+declares stencils and numbers is also kept in the disk cache (see diskcache.py) under the digest of its content and of
+grx itself, so later runs don't parse it at all. The entry also records the digest of every file the library
+included, directly or not, and is only used while each of those still has the same digest, since a change to a nested
+include doesn't change the digest of the library itself.
+'''
+
+# Libraries by absolute path
+libraries = {}
+
+# The settings which a library passes on to the context including it
+settings_names = ['defaultrange', 'arraysyntax', 'unroll']
+
+
+# Where @include looks for files, and the files it has used so far, for a document and everything it includes
+class Includes(object):
+
+	# parents are the paths of the libraries being parsed, to catch a library which includes itself
+	def __init__(self, directory = None, parents = ()):
+		self.directory = directory if directory is not None else os.getcwd()
+		self.parents = parents
+		# the digest of every file included, by absolute path
+		self.files = {}
+
+	def resolve(self, path):
+		return os.path.abspath(os.path.join(self.directory, os.path.expanduser(path)))
+
+
+class Library(object):
+
+	# variables is a list of (name, variable), settings a dict of the settings changed and files the digest of every
+	# file the library was parsed from, by path, including itself
+	def __init__(self, variables, settings, text, files):
+		self.variables = variables
+		self.settings = settings
+		self.text = text
+		self.files = files
+		self.stamps = dict([(path, stamp(path)) for path in files])
+
+	def current(self):
+		for (path, value) in self.stamps.iteritems():
+			if stamp(path) != value:
+				return False
+		return True
+
+	# A JSON value for the disk cache, or None if the library declares a variable which can't be written out
+	def serialize(self):
+		import tag.stencil
+
+		variables = []
+		for (name, variable) in self.variables:
+			if isinstance(variable, tag.stencil.StencilDefinition):
+				variables.append([name, 'stencil', [variable.points, variable.weights]])
+			elif isinstance(variable, num.ConstantNumber):
+				variables.append([name, 'number', variable.numvalue(None)])
+			else:
+				return None
+
+		settings = dict(self.settings)
+		if 'defaultrange' in settings:
+			settings['defaultrange'] = [number.numvalue(None) for number in settings['defaultrange']]
+
+		return {'variables': variables, 'settings': settings, 'text': self.text, 'files': self.files}
+
+	@staticmethod
+	def deserialize(value):
+		import tag.stencil
+
+		variables = []
+		for (name, kind, data) in value['variables']:
+			if kind == 'stencil':
+				(points, weights) = data
+				variable = tag.stencil.StencilDefinition(encode(points), encode(weights))
+			else:
+				variable = num.ConstantNumber.getinstance(str(data))
+			variables.append((encode(name), variable))
+
+		settings = dict([(encode(name), setting) for (name, setting) in value['settings'].iteritems()])
+		if 'defaultrange' in settings:
+			settings['defaultrange'] = [num.ConstantNumber.getinstance(str(number)) for number in settings['defaultrange']]
+		if isinstance(settings.get('arraysyntax'), unicode):
+			settings['arraysyntax'] = encode(settings['arraysyntax'])
+
+		files = dict([(encode(path), encode(digest)) for (path, digest) in value['files'].iteritems()])
+		return Library(variables, settings, encode(value['text']), files)
+
+
+# Return the Library for the file at path, which includes is including
+def load(path, includes):
+	path = includes.resolve(path)
+	if path in includes.parents:
+		raise Exception("'" + path + "' includes itself")
+
+	library = libraries.get(path)
+	if library is None or not library.current():
+		try:
+			with open(path) as f:
+				source = f.read()
+		except IOError, e:
+			raise Exception("can't read '" + path + "': " + str(e.strerror))
+
+		key = [path, digests.digest(source), digests.version()]
+		library = None
+		if diskcache.disk is not None:
+			value = diskcache.disk.get('include', key)
+			if value is not None:
+				library = Library.deserialize(value)
+				# the files it includes may have changed since
+				for (included, digest) in library.files.iteritems():
+					if included != path and digests.file_digest(included) != digest:
+						library = None
+						break
+
+		if library is None:
+			try:
+				library = parse(path, source, includes)
+			except Exception, e:
+				raise Exception(path + ': ' + str(e.message))
+
+			if diskcache.disk is not None:
+				value = library.serialize()
+				if value is not None:
+					diskcache.disk.put('include', key, value)
+
+		libraries[path] = library
+
+	includes.files.update(library.files)
+	return library
+
+
+# Parse and render source, the content of the file at path
+def parse(path, source, includes):
+	inner = Includes(os.path.dirname(path), includes.parents + (path,))
+	inner.files[path] = digests.digest(source)
+
+	context = parser.ParsingContext(lexer.lex_stream(StringIO(source)))
+	context.settings = parser.Settings(includes = inner)
+	out = StringIO()
+	try:
+		context.tokens_iterator.start()
+		for block in context.iterparse():
+			codegen.compile(block).render(out)
+		context.tokens_iterator.stop()
+
+	except Exception, e:
+		parser.raise_with_position(e, context.iterator_stack)
+
+	settings = {}
+	for name in settings_names:
+		if getattr(context.settings, name) is not None:
+			settings[name] = getattr(context.settings, name)
+
+	return Library(context.scope.variables(), settings, out.getvalue(), inner.files)
+
+
+# The modification time and size of path, None if it doesn't exist
+def stamp(path):
+	try:
+		status = os.stat(path)
+	except OSError:
+		return None
+	return (status.st_mtime, status.st_size)
+
+# Turn the unicode strings read back from JSON into str, recursively through lists
+def encode(value):
+	if isinstance(value, list):
+		return [encode(item) for item in value]
+	return value.encode('utf-8')
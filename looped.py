@@ -0,0 +1,136 @@
+from itertools import izip
+from tag.stencil import Offset, value_of
+
+'''
+Derivatives emitted as loops over a table of weights and offsets instead of one term per stencil point
+
+By default every derivative is unrolled. Below an @unroll[[ limit ]], a derivative with more than limit terms is
+emitted as a single loop instead, so that wide stencils in many dimensions don't blow up the size of the generated
+code. In C this is a GNU statement expression, which GCC, Clang and the Intel compiler accept:
+
+	({ static const double grx_w3_9[] = { ... }; static const int grx_o3_9_1[] = { ... }; double grx_s3_9 = 0.;
+	   int grx_n3_9; for (grx_n3_9 = 0; grx_n3_9 < 25; grx_n3_9++) grx_s3_9 += grx_w3_9[grx_n3_9] * (...); grx_s3_9; })
+
+where 3_9 is the line and column of the tag, so that nested derivatives don't clash. In Fortran it is a sum() of
+the weights times the expression evaluated at a vector subscript of offsets, which only works along one coordinate,
+so mixed derivatives are always unrolled there. A derivative inside a @pointscope is always unrolled too, since its
+temporaries are declared outside any loop.
+
+Passing a Report to AbstractBlock.render() records which way each derivative was emitted. Each way is only recorded
+the first time a derivative is rendered like that, rather than counted, since parts of the output which are repeated
+by an InvariantBlock or looked up in a memo (see invariant.py) aren't rendered again, so the report is the same with
+or without --memoize and --jobs.
+'''
+class Strategy(object):
+
+	# site is (line, char, tag name)
+	def __init__(self, site, limit, arraysyntax):
+		self.site = site
+		self.limit = limit
+		self.arraysyntax = arraysyntax
+		self.suffix = '%d_%d' % (site[0], site[1])
+
+	# Whether block, about to be rendered with terms for the derivative indices given, should be emitted as a loop
+	def choose(self, frame, block, terms, indices):
+		looped = self.limit is not None and len(terms) > self.limit and self.possible(block, terms, indices)
+		if frame.report is not None:
+			frame.report.record(self.site, 'looped' if looped else 'unrolled', len(terms))
+		return looped
+
+	def possible(self, block, terms, indices):
+		if block.pointenv is not None or len(terms) == 0:
+			return False
+		elif self.arraysyntax == 'C':
+			# the offsets go into a table of ints
+			for (offsets, prefix, coefficient) in terms:
+				for offset in offsets:
+					value = value_of(offset.point.replace('#', '0'))
+					if value is not None and value.denominator != 1:
+						return False
+			return True
+		elif self.arraysyntax == 'F':
+			return len(set(indices)) == 1
+		else:
+			return False
+
+	def write(self, out, frame, block, terms, indices):
+		# the positions of the indices along each coordinate, in order of first appearance
+		coordinates = []
+		for (position, index) in enumerate(indices):
+			for (coordinate, positions) in coordinates:
+				if coordinate == index:
+					positions.append(position)
+					break
+			else:
+				coordinates.append((index, [position]))
+
+		weights = [coefficient for (offsets, prefix, coefficient) in terms]
+		# the offset of each term along each coordinate, as written in the output
+		tables = []
+		for (coordinate, positions) in coordinates:
+			tables.append([offsets[positions[0]].point.replace('#', str(coordinate)) for (offsets, prefix, coefficient) in terms])
+
+		if self.arraysyntax == 'C':
+			self.write_c(out, frame, block, coordinates, weights, tables)
+		else:
+			self.write_fortran(out, frame, block, coordinates, weights, tables)
+
+	def write_c(self, out, frame, block, coordinates, weights, tables):
+		n = 'grx_n' + self.suffix
+		total = 'grx_s' + self.suffix
+
+		out.write('({ ')
+		out.write(table('double', 'grx_w' + self.suffix, weights))
+		for ((coordinate, positions), offsets) in izip(coordinates, tables):
+			name = 'grx_o' + self.suffix + '_' + str(coordinate)
+			out.write(table('int', name, offsets))
+			for position in positions:
+				frame[block.dpoints[position].slot] = Offset.get(name + '[' + n + ']')
+
+		out.write('double %s = 0.; int %s; ' % (total, n))
+		out.write('for (%s = 0; %s < %d; %s++) ' % (n, n, len(weights), n))
+		out.write('%s += grx_w%s[%s] * (' % (total, self.suffix, n))
+		block.body.write(out, frame)
+		out.write('); %s; })' % total)
+
+	def write_fortran(self, out, frame, block, coordinates, weights, tables):
+		for position in coordinates[0][1]:
+			frame[block.dpoints[position].slot] = Offset.get('/ ' + ', '.join(tables[0]) + ' /')
+
+		out.write('sum((/ ' + ', '.join(weights) + ' /) * (')
+		block.body.write(out, frame)
+		out.write('))')
+
+
+# A C array declaration, static unless some of the values might not be constants
+def table(vartype, name, values):
+	if all(value_of(value) is not None for value in values):
+		vartype = 'static const ' + vartype
+	else:
+		vartype = 'const ' + vartype
+	return '%s %s[] = { %s }; ' % (vartype, name, ', '.join(values))
+
+
+class Report(object):
+
+	def __init__(self):
+		# site -> set of (strategy, number of terms)
+		self._sites = {}
+
+	def record(self, site, strategy, terms):
+		self._sites.setdefault(site, set()).add((strategy, terms))
+
+	# The entries recorded, to merge() into another report
+	def sites(self):
+		return self._sites
+
+	def merge(self, sites):
+		for (site, uses) in sites.iteritems():
+			self._sites.setdefault(site, set()).update(uses)
+
+	def lines(self):
+		lines = []
+		for site in sorted(self._sites):
+			uses = ['%s with %d terms' % (strategy, terms) for (strategy, terms) in sorted(self._sites[site])]
+			lines.append('%d:%d: %s %s' % (site[0], site[1], site[2], ', '.join(uses)))
+		return lines
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+'''
+A bounded, least recently used cache of rendered strings
+
+Pass one to AbstractBlock.render() to memoize the parts of loop bodies whose dependencies are known, see invariant.py.
+Entries are keyed on a block and the values of the variables it reads, so a memo can be shared by several renders,
+though not by several threads at once.
+'''
+class Memo(object):
+
+	def __init__(self, capacity = 4096):
+		if capacity < 1:
+			raise ValueError("the memo capacity must be at least 1")
+
+		self.capacity = capacity
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		# the most entries used by a memo merged in
+		self._merged_entries = 0
+
+	def __len__(self):
+		return len(self._entries)
+
+	# Return the string stored under key, or None
+	def get(self, key):
+		try:
+			string = self._entries.pop(key)
+		except KeyError:
+			self.misses = self.misses + 1
+			return None
+
+		# move it back to the most recently used end
+		self._entries[key] = string
+		self.hits = self.hits + 1
+		return string
+
+	def put(self, key, string):
+		self._entries[key] = string
+		if len(self._entries) > self.capacity:
+			self._entries.popitem(last = False)
+
+	# Add the statistics of another memo, e.g. one in a worker process, see parallel.py
+	def merge(self, hits, misses, entries):
+		self.hits = self.hits + hits
+		self.misses = self.misses + misses
+		self._merged_entries = max(self._merged_entries, entries)
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		if lookups > 0:
+			rate = 100.0 * self.hits / lookups
+		else:
+			rate = 0.0
+		entries = max(len(self), self._merged_entries)
+		return 'memo: %d hits, %d misses (%.1f%% hit rate), %d of %d entries used' % (self.hits, self.misses, rate, entries, self.capacity)
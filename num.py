@@ -1,7 +1,17 @@
 import parser
 
 class AbstractNumber(parser.AbstractVariable):
-	pass
+
+	# numbers can be used directly as blocks
+	def write(self, out, frame):
+		out.write(self.execute(frame))
+
+	def compile(self, gen):
+		gen.write('str(' + self.compile_value(gen) + ')')
+
+	# Python expression for numvalue() in generated code
+	def compile_value(self, gen):
+		return gen.constant(self) + '.numvalue(' + gen.frame() + ')'
 
 
 class ConstantNumber(AbstractNumber):
@@ -25,12 +35,42 @@ class ConstantNumber(AbstractNumber):
 
 		return ConstantNumber.singletons[value_int]
 
-	def numvalue(self):
+	def dependencies(self):
+		return frozenset()
+
+	def numvalue(self, frame):
 		return self._value
 
-	def execute(self):
+	def execute(self, frame):
 		return str(self._value)
 
+	def compile(self, gen):
+		gen.literal(str(self._value))
+
+	def compile_value(self, gen):
+		return repr(self._value)
+
+
+# A number which is only given when rendering, e.g. the bounds of the default range of a template.Template, kept in
+# the render frame under the slot it was allocated
+class Parameter(AbstractNumber):
+
+	def __init__(self, name):
+		self.name = name
+		self.slot = None
+
+	def dependencies(self):
+		return frozenset([self])
+
+	def numvalue(self, frame):
+		return frame[self.slot]
+
+	def execute(self, frame):
+		return str(frame[self.slot])
+
+	def compile_value(self, gen):
+		return '%s[%d]' % (gen.frame(), self.slot)
+
 
 def fromstring(string, context):
 	string = string.strip()
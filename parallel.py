@@ -0,0 +1,120 @@
+import multiprocessing
+import parser
+import iteration
+import codegen
+import memo
+import looped
+from cStringIO import StringIO
+
+'''
+Renders the top level blocks of a document on a pool of processes
+
+Each top level block is rendered with a frame of its own anyway, so they don't depend on each other. A top level
+@iterate is split further into chunks of values of its counter, unless it is ordered (see IterationBlock). The pool is
+started after the document has been parsed, so the forked workers already hold the blocks and only the index of a
+block and the values to render are sent to them; the partial outputs are written out in the order of the document,
+whatever order they finish in.
+
+Workers keep a memo.Memo each if the render has one, and their hit rates and looped.Report entries are added to the
+memo and report given to render().
+'''
+
+# The blocks being rendered, inherited by the workers
+_blocks = None
+# In a worker: the memo and the compiled blocks and @iterate bodies, by the index of the block
+_memo = None
+_compiled = {}
+
+
+# Render blocks to out using jobs processes
+def render(blocks, out, jobs, cache = None, report = None):
+	global _blocks
+	_blocks = blocks
+
+	capacity = cache.capacity if cache is not None else None
+	pool = multiprocessing.Pool(jobs, _start_worker, (capacity, ))
+	try:
+		results = []
+		for (index, block) in enumerate(blocks):
+			if block.trivial:
+				results.append(_Rendered(block))
+				continue
+
+			parts = chunks(block, jobs)
+			for (number, values) in enumerate(parts):
+				arguments = (index, values, number == 0, number == len(parts) - 1, report is not None)
+				results.append(pool.apply_async(_render, arguments))
+
+		for result in results:
+			(string, hits, misses, entries, sites) = result.get()
+			out.write(string)
+			if cache is not None:
+				cache.merge(hits, misses, entries)
+			if report is not None:
+				report.merge(sites)
+
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+		_blocks = None
+
+
+# The lists of values of the counter of a top level @iterate to render separately, or just [None] for the whole block
+def chunks(block, jobs):
+	if not isinstance(block, iteration.IterationBlock) or block.ordered:
+		return [None]
+
+	# before, after and the range of the counter can't depend on anything at the top level
+	values = list(block.counter.values(parser.Frame()))
+	if not values:
+		return [None]
+	size = max(1, len(values) // (4 * jobs))
+	return [values[i:i + size] for i in xrange(0, len(values), size)]
+
+
+# A trivial block rendered straight away rather than by a worker
+class _Rendered(object):
+
+	def __init__(self, block):
+		self._string = block.execute(parser.Frame())
+
+	def get(self):
+		return (self._string, 0, 0, 0, {})
+
+
+def _start_worker(capacity):
+	global _memo
+	if capacity is not None:
+		_memo = memo.Memo(capacity)
+
+
+# Render the block at index, or only the given values of its counter, with before if first and after if last, returning
+# the output along with the memo statistics and report entries added
+def _render(index, values, first, last, reporting):
+	block = _blocks[index]
+	(hits, misses) = (_memo.hits, _memo.misses) if _memo is not None else (0, 0)
+	report = looped.Report() if reporting else None
+	frame = parser.Frame(_memo, report)
+	out = StringIO()
+
+	if values is None:
+		if index not in _compiled:
+			_compiled[index] = codegen.compile(block)
+		_compiled[index].write(out, frame)
+
+	else:
+		if index not in _compiled:
+			_compiled[index] = codegen.compile(block.body)
+
+		if first:
+			block.before.write(out, frame)
+		block.write_values(out, frame, values, _compiled[index])
+		if last:
+			block.after.write(out, frame)
+
+	sites = report.sites() if report is not None else {}
+	if _memo is None:
+		return (out.getvalue(), 0, 0, 0, sites)
+	else:
+		return (out.getvalue(), _memo.hits - hits, _memo.misses - misses, len(_memo), sites)
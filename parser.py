@@ -1,79 +1,288 @@
 import traceback
+import copy
 import re
+import lexer
+from cStringIO import StringIO
 
-iterator_stack = []
 verbose_error = False
 valid_varname = re.compile(r"[a-zA-Z_]\w*");
 
-def parse(tokens):
+# settings are those the document starts with, e.g. to say where @include looks for files
+def parse(tokens, settings = None):
+	context = ParsingContext(tokens)
+	if settings is not None:
+		context.settings = settings
 	try:
-		context = ParsingContext(tokens)
 		return context.parse()
 	
 	except Exception, e:
-		if verbose_error:
-			print traceback.format_exc()
+		raise_with_position(e, context.iterator_stack)
 
-		token = iterator_stack[-1].current()
-		raise Exception('Error: ' + str(token.line) + ':' + str(token.char) + ': ' + str(e.message))
-	
 
-class AbstractBlock(object):
+# Parse a (possibly lazy) sequence of tokens, yielding each top level block as soon as it is complete
+def parse_stream(tokens, settings = None):
+	context = ParsingContext(tokens)
+	if settings is not None:
+		context.settings = settings
+	try:
+		context.tokens_iterator.start()
+		for block in context.iterparse():
+			yield block
+		context.tokens_iterator.stop()
+
+	except Exception, e:
+		raise_with_position(e, context.iterator_stack)
+
+
+# iterator_stack holds the TokenIterators of the document being parsed, innermost last
+def raise_with_position(e, iterator_stack):
+	if isinstance(e, (lexer.LexerError, SourceError)):
+		# these already say where they are
+		raise e
+
+	if verbose_error:
+		print traceback.format_exc()
+
+	# report the innermost token read so far
+	token = None
+	for iterator in reversed(iterator_stack):
+		token = iterator.current()
+		if token is not None:
+			break
+
+	if token is None:
+		raise Exception(str(e.message))
+
+	raise_at(e, token.line, token.char)
+
+
+# Raise e again with a position in the source, e.g. that of the tag whose block failed while rendering
+def raise_at(e, line, char):
+	raise SourceError('Error: ' + str(line) + ':' + str(char) + ': ' + str(e.message))
+
+
+class SourceError(Exception):
 	pass
 
 
+# The text to show for an error e, which for an IOError or OSError is the reason along with the file, since their
+# message is empty
+def error_message(e):
+	if isinstance(e, EnvironmentError) and e.strerror:
+		if e.filename:
+			return e.filename + ': ' + e.strerror
+		return e.strerror
+	return str(e.message)
+
+
+'''
+Blocks render either by returning a string from execute(frame), or by writing fragments to a file-like sink in
+write(out, frame). Each subclass needs to override at least one of the two. Large blocks should implement write() so
+that their output is streamed rather than built up in memory.
+
+Parsed blocks are not modified while rendering, except for caches of values that depend only on the parsed blocks
+themselves, which are filled the first time they are needed: the terms of a @dn for each way its indices coincide,
+tensor products of stencils (see StencilDefinition.product()) and the text of an Offset in each dimension. Working one
+of them out again gives the same value and storing it is a single dict assignment, so renders on several threads at
+worst work a value out twice. Everything else that changes during a render, such as the values of iteration counters,
+lives in the Frame. Each call to render() starts from an empty one, so a parsed document can be rendered by several
+threads at once.
+'''
+class AbstractBlock(object):
+
+	# Blocks which are too cheap to be worth caching, see invariant.py
+	trivial = False
+
+	# Return the set of variables (iteration counters, stencil points) whose values this block reads while rendering,
+	# or None if that isn't known or rendering the block has side effects
+	def dependencies(self):
+		return None
+
+	# memo is an optional memo.Memo to look up repeated parts of the output in, see invariant.py
+	# report is an optional looped.Report to record how each derivative was emitted in
+	def render(self, out, memo = None, report = None):
+		self.write(out, Frame(memo, report))
+
+	def execute(self, frame):
+		out = StringIO()
+		self.write(out, frame)
+		return out.getvalue()
+
+	def write(self, out, frame):
+		out.write(self.execute(frame))
+
+	# Emit Python code which renders this block, see codegen.py
+	def compile(self, gen):
+		gen.fallback(self)
+
+
+# A dict from the slots allocated by Scope to their current values, which also holds the output cached by
+# invariant.InvariantBlock
+class Frame(dict):
+
+	def __init__(self, memo = None, report = None):
+		dict.__init__(self)
+		self.memo = memo
+		self.report = report
+
+
 class BlockSequence(AbstractBlock):
 	
 	def __init__(self, blocks):
 		self.blocks = blocks
 
-	def execute(self):
-		output = ''
+	def dependencies(self):
+		return dependencies(self.blocks)
 
+	def write(self, out, frame):
 		for block in self.blocks:
-			output = output + block.execute()
+			block.write(out, frame)
 
-		return output
+	def compile(self, gen):
+		for block in self.blocks:
+			block.compile(gen)
+
+
+# Return the union of the dependencies of blocks, or None if any of them is unknown
+def dependencies(blocks):
+	union = frozenset()
+	for block in blocks:
+		block_dependencies = block.dependencies()
+		if block_dependencies is None:
+			return None
+		union = union | block_dependencies
+	return union
 
 
 class AbstractVariable(object):
 	def uniquename(self):
 		return '$' + str(id(self))
 
+	# Variables may appear among blocks, see AbstractBlock.dependencies()
+	def dependencies(self):
+		return None
+
+
+'''
+Maps the names visible in a context to the variables declared with e.g. @iterate, @stencil and @defaultrange
+
+Each variable is given the next free slot in a table shared by the whole document, and every scope keeps a flat map
+from all the names it can see to their slots, so a lookup costs one dict access however deeply contexts are nested.
+A nested scope shares its parent's map until it declares a name of its own. Contexts are parsed one after another,
+so a nested scope is always finished before its parent declares anything else. Declaring a name replaces the map
+rather than changing it, so state() is just a reference to the current one.
+'''
+class Scope(object):
+
+	def __init__(self, parent = None):
+		if parent is None:
+			self.slots = []
+			self._names = {}
+		else:
+			self.slots = parent.slots
+			self._names = parent._names
+
+		# names declared in this scope itself, None while the map is still shared with the parent
+		self._local = None
+
+	# Return the slot holding the variable called name, or None
+	def resolve(self, name):
+		slot = self._names.get(name)
+		if slot is None:
+			# surrounding whitespace is ignored for names declared in an enclosing scope
+			stripped = name.strip()
+			if stripped != name and (self._local is None or stripped not in self._local):
+				slot = self._names.get(stripped)
+		return slot
+
+	def getvar(self, name):
+		slot = self.resolve(name)
+		if slot is None:
+			return None
+		else:
+			return self.slots[slot]
+
+	# Return the slot allocated to varobj
+	def declare(self, name, varobj):
+		if self.resolve(name) is not None:
+			raise Exception("the name '" + name + "' is already declared in this context")
+
+		slot = self.allocate(varobj)
+		self._names = dict(self._names)
+		self._names[name] = slot
+		self._local = set(self._local or ())
+		self._local.add(name)
+		return slot
+
+	# A list of (name, variable) for all the names visible in this scope
+	def variables(self):
+		return [(name, self.slots[slot]) for (name, slot) in self._names.iteritems()]
+
+	# The names declared so far, for restore() to go back to, e.g. to parse part of a document again
+	def state(self):
+		return (len(self.slots), self._names, self._local)
+
+	def restore(self, state):
+		(size, self._names, self._local) = state
+		del self.slots[size:]
+
+	# Allocate a slot without a name, e.g. for state which only exists while rendering
+	def allocate(self, obj = None):
+		self.slots.append(obj)
+		return len(self.slots) - 1
+
+
+'''
+Settings which apply to a context and everything nested inside it: the range set by @defaultrange, the syntax set
+by @arraysyntax, the environment which @define writes to, the @pointscope which derivatives put their stencil
+points in, the number of terms above which @unroll has derivatives emitted as loops and the library.Includes which
+@include resolves files with and records them in. Settings objects are never modified, a tag changing a setting gives
+its context a new object from replace(), so nested contexts can simply share their parent's.
+'''
+class Settings(object):
+
+	def __init__(self, defaultrange = None, arraysyntax = None, defineenv = None, pointenv = None, unroll = None,
+			includes = None):
+		self.defaultrange = defaultrange
+		self.arraysyntax = arraysyntax
+		self.defineenv = defineenv
+		self.pointenv = pointenv
+		self.unroll = unroll
+		self.includes = includes
+
+	def replace(self, **changes):
+		settings = copy.copy(self)
+		for (name, value) in changes.iteritems():
+			if not hasattr(settings, name):
+				raise AttributeError("unknown setting '" + name + "'")
+			setattr(settings, name, value)
+		return settings
+
 
 class ParsingContext(object):
 
 	def __init__(self, tokens, parent = None):
 		self.parent = parent
-		self._localvars = {}
+
+		if parent is None:
+			self.scope = Scope()
+			self.settings = Settings()
+			self.iterator_stack = []
+		else:
+			self.scope = Scope(parent.scope)
+			self.settings = parent.settings
+			self.iterator_stack = parent.iterator_stack
 
 		if isinstance(tokens, TokenIterator):
 			self.tokens_iterator = tokens
 		else:
-			self.tokens_iterator = TokenIterator(tokens)
+			self.tokens_iterator = TokenIterator(tokens, self.iterator_stack)
 
 	def getvar(self, varname):
-		if varname in self._localvars:
-			return self._localvars[varname.strip()]
-		elif self.parent is not None:
-			return self.parent.getvar(varname.strip())
-		else:
-			return None
+		return self.scope.getvar(varname)
 
 	def declare(self, varname, varobj):
-		if self.getvar(varname) is None:
-			self._localvars[varname] = varobj
-		else:
-			raise Exception("the name '" + varname + "' is already declared in this context")
-
-	def __getattribute__(self, name):
-		try:
-			return object.__getattribute__(self, name)
-		except AttributeError, e:
-			if self.parent is not None:
-				return self.parent.__getattribute__(name)
-			else:
-				raise e
+		return self.scope.declare(varname, varobj)
 
 	def __iter__(self):
 		return self.tokens_iterator
@@ -91,53 +300,60 @@ class ParsingContext(object):
 	def parse_all(self):
 		self._blocks = []
 
+		for block in self.iterparse():
+			self._blocks.append(block)
+
+		return BlockSequence(self._blocks)
+
+	# Yield blocks one at a time as the tokens are parsed
+	def iterparse(self):
 		for token in self.tokens_iterator:
 			try:
 				block = self.parse_token(token)
-				if isinstance(block, AbstractBlock):
-					self._blocks.append(block)
 			except LeaveContext:
 				break
 
-		return BlockSequence(self._blocks)
+			if isinstance(block, AbstractBlock):
+				yield block
 
 	def parse_token(self, token):
 		return token.parse(self)
 
 
+# tokens may be a TokenSequence or any other iterable, e.g. the generator from lexer.lex_stream
+# stack is shared by all the TokenIterators of one document, see ParsingContext
 class TokenIterator(object):
 
-	def __init__(self, tokens):
+	def __init__(self, tokens, stack):
 		self._tokens = tokens
+		self._stack = stack
+		self._iterator = iter(())
+		self._current = None
 		self.start_count = 0
 	
 	def __iter__(self):
 		return self
 
 	def current(self):
-		return self._tokens[self._index - 1]
+		return self._current
 
 	def start(self):
 		if self.start_count == 0:
-			self._index = 0
-			iterator_stack.append(self)
+			self._iterator = iter(self._tokens)
+			self._stack.append(self)
 		self.start_count = self.start_count + 1
 
 	def stop(self):
 		self.start_count = self.start_count - 1
 		if self.start_count == 0:
-			iterator_stack.pop()
-			self._index = len(self._tokens)
+			self._stack.pop()
+			self._iterator = iter(())
 
 	def next(self):
-		if iterator_stack[-1] is not self:
-			raise Exception('cannot advance the TokenIterator which is not currently on top of iterator_stack')
-		if self._index < len(self._tokens):
-			token = self._tokens[self._index]
-			self._index = self._index + 1
-			return token
-		else:
-			raise StopIteration
+		if self._stack[-1] is not self:
+			raise Exception('cannot advance the TokenIterator which is not currently on top of the iterator stack')
+		self._current = next(self._iterator)
+		return self._current
 
 
 class LeaveContext(Exception):
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import socket
+import struct
+import traceback
+import SocketServer
+import grxc
+
+'''
+A long lived grx which renders for grxc.py over a Unix socket, so that each file doesn't pay for starting Python
+
+The server imports grx and every tag module once, and loads the libraries given to it for @include (see library.py),
+then forks a process for each request, which starts out with all of that already in memory. A request is a line of
+JSON with the command line, the working directory and the environment variables grx reads, followed by the input when
+it is read from stdin. The process runs the command line as grx.py would, from the same directory, and sends back its
+output as frames (see Output), which grxc.py writes to its own stdout and stderr, and then its exit status.
+Since each request runs in a process of its own, options like --no-cache only apply to that request.
+'''
+
+# Listen on the socket at path, by default grxc.default_path(), until interrupted, answering each request with
+# main(argv)
+def serve(path, libraries, main):
+	import tag
+	import library
+
+	if path is None:
+		path = grxc.default_path()
+	tag.load_all()
+	for name in libraries:
+		library.load(os.path.abspath(name), library.Includes())
+
+	if os.path.exists(path):
+		# a socket left behind by a server which has stopped can be replaced
+		try:
+			grxc.connect(path).close()
+			raise Exception("a server is already listening on " + path)
+		except socket.error:
+			os.remove(path)
+
+	directory = os.path.dirname(os.path.abspath(path))
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	server = Server(path, Handler)
+	server.main = main
+	print >> sys.stderr, 'grx: serving on ' + path + ', press Ctrl-C to stop'
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.remove(path)
+
+
+class Server(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+	# the most requests served at once, enough for a parallel make
+	max_children = 256
+
+
+# Runs in the process forked for a request, so it can change the directory, environment and globals as it likes
+class Handler(SocketServer.StreamRequestHandler):
+
+	def handle(self):
+		import diskcache
+
+		line = self.rfile.readline()
+		if line == '':
+			# e.g. serve() checking whether the socket is in use
+			return
+
+		output = Output(self.wfile)
+		status = 1
+		try:
+			request = json.loads(line)
+			os.chdir(request['cwd'])
+			for name in grxc.environ:
+				if name in request['environ']:
+					os.environ[name] = request['environ'][name].encode('utf-8')
+				elif name in os.environ:
+					del os.environ[name]
+			if diskcache.disk is not None:
+				diskcache.disk = diskcache.default()
+
+			sys.stdin = self.rfile
+			sys.stdout = Channel(output, 'o')
+			sys.stderr = Channel(output, 'e')
+			status = self.server.main([arg.encode('utf-8') for arg in request['argv']])
+
+		except SystemExit, e:
+			status = e.code if isinstance(e.code, int) else 1
+		except Exception:
+			output.write('e', traceback.format_exc())
+
+		output.write('x', str(status))
+		output.flush()
+
+
+# Collects the frames of a response, in order, and sends them in chunks, see grxc.read_frame()
+class Output(object):
+
+	def __init__(self, stream, chunk_size = 65536):
+		self.stream = stream
+		self.chunk_size = chunk_size
+		self._frames = []
+		self._size = 0
+
+	def write(self, channel, data):
+		self._frames.append(struct.pack('!cI', channel, len(data)) + data)
+		self._size = self._size + len(data)
+		if self._size >= self.chunk_size:
+			self.flush()
+
+	def flush(self):
+		self.stream.write(''.join(self._frames))
+		self.stream.flush()
+		self._frames = []
+		self._size = 0
+
+
+# A file-like object writing to one channel of an Output, to stand in for sys.stdout or sys.stderr
+class Channel(object):
+
+	def __init__(self, output, channel):
+		self.output = output
+		self.channel = channel
+		self.softspace = 0
+
+	def write(self, data):
+		if data:
+			self.output.write(self.channel, str(data))
+
+	def writelines(self, lines):
+		for line in lines:
+			self.write(line)
+
+	def flush(self):
+		pass
@@ -1,3 +1,4 @@
+import re
 import parser
 
 class Mode:
@@ -10,22 +11,49 @@ class SubstitutionBlock(parser.AbstractBlock):
 		self.env = env
 		self.content = content
 		
-	def execute(self):
+	def write(self, out, frame):
 		if self.env.mode == Mode.REPLACE:
-			return self.env.replace(self.content.execute())
+			# replacements can only be made once the whole scope is known
+			out.write(self.env.replace(frame, self.content.execute(frame)))
 		elif self.env.mode == Mode.PRAGMA:
-			return self.content.execute() + self.env.undef_string()
+			self.content.write(out, frame)
+			out.write(self.env.undef_string(frame))
+
+	def compile(self, gen):
+		if self.env.mode == Mode.REPLACE:
+			content = gen.capture(self.content)
+			gen.write('%s.replace(%s, %s)' % (gen.constant(self.env), gen.frame(), content))
+		elif self.env.mode == Mode.PRAGMA:
+			self.content.compile(gen)
+			gen.write('%s.undef_string(%s)' % (gen.constant(self.env), gen.frame()))
 
 
 class DefinitionBlock(parser.AbstractBlock):
 
-	def __init__(self, env, matchblock, replaceblock):
+	# position is the (line, char) of the @define, which errors in the definition are reported at
+	def __init__(self, env, matchblock, replaceblock, position = None):
 		self.env = env
 		self.matchblock = matchblock
 		self.replaceblock = replaceblock
+		self.position = position
 
-	def execute(self):
-		(match, replace) = self.env.define(self.matchblock.execute(), self.replaceblock.execute())
+	def execute(self, frame):
+		return self.define(frame, self.matchblock.execute(frame), self.replaceblock.execute(frame))
+
+	def compile(self, gen):
+		match = gen.capture(self.matchblock)
+		replace = gen.capture(self.replaceblock)
+		gen.write('%s.define(%s, %s, %s)' % (gen.constant(self), gen.frame(), match, replace))
+
+	# Record the definition and return the text it produces
+	def define(self, frame, rawmatch, rawreplace):
+		try:
+			(match, replace) = self.env.define(frame, rawmatch, rawreplace)
+		except Exception, e:
+			if self.position is None:
+				raise
+			# definitions are only made while rendering, once the parser has moved on
+			parser.raise_at(e, *self.position)
 
 		if self.env.mode == Mode.REPLACE:
 			return ''
@@ -36,58 +64,245 @@ class DefinitionBlock(parser.AbstractBlock):
 				return ''
 
 
+# The definitions made while rendering are kept in the render frame, under the slot allocated by the parser
 class SubstitutionEnvironment(object):
 
-	max_iteration = 10
-
-	def __init__(self, mode = Mode.REPLACE):
-		self.dict = {}
+	def __init__(self, slot, mode = Mode.REPLACE):
+		self.slot = slot
 		if not (mode == Mode.REPLACE or mode == Mode.PRAGMA):
 			raise ValueError("invalid mode for SubstitutionEnvironment")
 		else:
 			self.mode = mode
 
 
-	def define(self, rawmatch, rawreplace):
+	# The Definitions made so far in this render
+	def definitions(self, frame):
+		definitions = frame.get(self.slot)
+		if definitions is None:
+			definitions = frame[self.slot] = Definitions()
+		return definitions
+
+
+	def define(self, frame, rawmatch, rawreplace):
 		match = rawmatch.strip()
 		replace = rawreplace.strip()
+		definitions = self.definitions(frame)
 
 		if match == replace:
 			return (None, None)
 
-		elif match in self.dict and self.dict[match] != replace:
+		elif match in definitions and definitions[match] != replace:
 			raise Exception(match + ' has already been @defined')
-		
+
 		else:
-			self.dict[match] = replace
-			return (match, replace)
+			definitions.add(match, replace)
+			return (match, definitions.final(match))
 
 
-	def undef_string(self):
+	def undef_string(self, frame):
 		string = '\n'
-		for match in self.dict:
+		for match in self.definitions(frame):
 			string = string + '#undef ' + match + '\n'
 		return string
 
 
-	def replace(self, string):
-		done = False
-		oldstring = string
-		newstring = string
-		iterations = 0
+	# Definitions are fully resolved as they are made, so a single pass replaces everything
+	def replace(self, frame, string):
+		definitions = self.definitions(frame)
+		if len(definitions) == 0:
+			return string
+
+		return definitions.pattern().sub(lambda m: Definitions.parenthesize(definitions.final(m.group(0))), string)
+
+
+'''
+The definitions made in one @definescope: a dict from each name to its replacement as written
+
+Definitions form a graph, with an edge from each name to the defined names its replacement mentions. Cycles are
+rejected by add() as soon as they would appear, and final() resolves the replacements along the graph: a name
+defined as just another name (an alias) is replaced straight away by what that name stands for, so chains like
+A -> B -> C collapse to A -> C, while other names mentioned in a replacement are substituted in parentheses, unless
+they stand for a single word.
+
+Names are matched as whole tokens: one which starts (ends) with a letter, digit or underscore doesn't match right
+after (before) another such character, so g12 is not found inside dg123. Where one name is a prefix of another, the
+longer one is preferred.
+'''
+class Definitions(dict):
+
+	word_char = re.compile(r"\w")
+	word = re.compile(r"\w+")
+
+	def __init__(self):
+		dict.__init__(self)
+		self._pattern = None
+		self._final = {}
+
+		# name -> the defined names its replacement mentions
+		self._references = {}
+		# word -> the names whose replacement contains it, to find who mentions a new name without scanning everything
+		self._mentions = {}
+		# first word of a name -> the names starting with it, to find the names in a new replacement likewise
+		self._names_by_word = {}
+		self._names_without_words = set()
+		self._token_regex = {}
+
+	def add(self, match, replace):
+		if match in self:
+			return
+
+		references = self.references(replace) | self.references_to(match, replace)
+		mentioned_by = self.mentioned_by(match)
+
+		for name in mentioned_by:
+			self._references[name].add(match)
+		self._references[match] = references
+
+		# a new cycle would have to run from the new name back to itself, which needs an edge into it
+		if len(mentioned_by) > 0 or match in references:
+			chain = self.find_path(match, match)
+			if chain is not None:
+				for name in mentioned_by:
+					self._references[name].discard(match)
+				del self._references[match]
+				raise Exception('circular @define: ' + ' -> '.join(chain))
 
-		while not done and iterations < SubstitutionEnvironment.max_iteration:
-			for match in self.dict:
-				newstring = newstring.replace(match, '(' + self.dict[match] + ')')
+			# the replacements which mention the new name are no longer final
+			self._final = {}
 
-			done = (newstring == oldstring)
-			oldstring = newstring
-			iterations = iterations + 1
+		dict.__setitem__(self, match, replace)
+		self._pattern = None
 
-		if not done:
-			raise Exception("SubstitutionEnvironment has not converged after " + str(SubstitutionEnvironment.max_iteration) + ' attempts, suspect circular @defines')
+		for word in set(Definitions.word.findall(replace)):
+			self._mentions.setdefault(word, set()).add(match)
+
+		first = Definitions.word.search(match)
+		if first is None:
+			self._names_without_words.add(match)
+		else:
+			self._names_by_word.setdefault(first.group(0), set()).add(match)
+
+	# The defined names which text mentions
+	def references(self, text):
+		candidates = set(self._names_without_words)
+		for word in Definitions.word.findall(text):
+			candidates.update(self._names_by_word.get(word, ()))
+		return set([name for name in candidates if self.token_regex(name).search(text)])
+
+	# match itself, if its own replacement mentions it
+	def references_to(self, match, replace):
+		if self.token_regex(match).search(replace):
+			return set([match])
+		else:
+			return set()
+
+	# The defined names whose replacement mentions name
+	def mentioned_by(self, name):
+		first = Definitions.word.search(name)
+		if first is None:
+			candidates = self.keys()
+		else:
+			candidates = self._mentions.get(first.group(0), ())
+		return [other for other in candidates if self.token_regex(name).search(self[other])]
+
+	# Return the names along a path of references from start to end, or None
+	def find_path(self, start, end):
+		parents = {}
+		stack = [start]
+		while stack:
+			name = stack.pop()
+			for reference in self._references[name]:
+				if reference == end:
+					path = [end, name]
+					while name != start:
+						name = parents[name]
+						path.append(name)
+					path.reverse()
+					return path
+				if reference not in parents:
+					parents[reference] = name
+					stack.append(reference)
+		return None
+
+	def token_regex(self, name):
+		if name not in self._token_regex:
+			self._token_regex[name] = re.compile(Definitions.trie_regex(Definitions.trie([name]), ''))
+		return self._token_regex[name]
+
+	# The replacement for name, with every defined name in it resolved
+	def final(self, name):
+		if name in self._final:
+			return self._final[name]
+
+		# follow a chain of aliases to its end first
+		aliases = []
+		while self[name] in self and name not in self._final:
+			aliases.append(name)
+			name = self[name]
+
+		if name not in self._final:
+			replace = self[name]
+			references = self._references[name]
+
+			if len(references) == 0:
+				self._final[name] = replace
+			else:
+				pattern = re.compile(Definitions.trie_regex(Definitions.trie(references), ''))
+				self._final[name] = pattern.sub(lambda m: Definitions.parenthesize(self.final(m.group(0))), replace)
+
+		for alias in aliases:
+			self._final[alias] = self._final[name]
+		return self._final[name]
+
+	# Wrap a replacement in parentheses, unless it is a single word which needs none
+	@staticmethod
+	def parenthesize(string):
+		m = Definitions.word.match(string)
+		if m is not None and m.end() == len(string):
+			return string
 		else:
-			return newstring
+			return '(' + string + ')'
+
+	# A regex which finds all the defined names in a single scan
+	def pattern(self):
+		if self._pattern is None:
+			self._pattern = re.compile(Definitions.trie_regex(Definitions.trie(self), ''))
+		return self._pattern
 
+	@staticmethod
+	def trie(names):
+		trie = {}
+		for name in names:
+			node = trie
+			for char in name:
+				node = node.setdefault(char, {})
+			# the empty key marks the end of a name
+			node[''] = None
+		return trie
 
-	
\ No newline at end of file
+	# Regex matching the names in the trie below node, which is reached after the character previous
+	# Spelling out the trie as nested groups means matching costs at most one step per character of the longest name
+	# at each position, however many names there are
+	@staticmethod
+	def trie_regex(node, previous):
+		alternatives = []
+
+		for char in sorted(node):
+			if char == '':
+				continue
+			regex = re.escape(char)
+			if previous == '' and Definitions.word_char.match(char):
+				regex = r"(?<!\w)" + regex
+			alternatives.append(regex + Definitions.trie_regex(node[char], char))
+
+		# the end of a name goes last, so that longer names are tried first
+		if '' in node:
+			if Definitions.word_char.match(previous):
+				alternatives.append(r"(?!\w)")
+			else:
+				alternatives.append('')
+
+		if len(alternatives) == 1:
+			return alternatives[0]
+		else:
+			return '(?:' + '|'.join(alternatives) + ')'
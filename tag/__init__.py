@@ -1,18 +1,30 @@
+import os
 import lexer
 import parser
 
 tags = {}
 
 def token_class(tagname):
-	# Each tag type is defined as a python submodule with the same name
+	# Each tag type is defined as a python submodule with the same name, which is only looked up the first time
 	try:
 		return tags[tagname]
 
 	except KeyError:
 		try:
-			return __import__('tag', globals(), locals(), [tagname], -1).__getattribute__(tagname).token_class()
+			cls = __import__('tag', globals(), locals(), [tagname], -1).__getattribute__(tagname).token_class()
 		except Exception:
-			return TagToken
+			cls = TagToken
+		tags[tagname] = cls
+		return cls
+
+
+# Import the modules of all the tags, e.g. before forking processes which will parse documents
+def load_all():
+	directory = os.path.dirname(os.path.abspath(__file__))
+	for filename in sorted(os.listdir(directory)):
+		(name, extension) = os.path.splitext(filename)
+		if extension == '.py' and name != '__init__':
+			token_class(name)
 
 
 def create_token(line, char, name, args = []):
@@ -11,11 +11,17 @@ class ArraySyntaxTagToken(tag.TagToken):
 		if len(self.args) != 1:
 			raise ValueError("@arraysyntax takes exactly one argument")
 
-		syntax = text.PlainStringContext(self.args[0], context).parse().strip().upper()
-		
-		if syntax == 'C':
-			context.arraysyntax = 'C'
-		elif syntax == 'F' or syntax == 'F90' or syntax == 'FORTRAN':
-			context.arraysyntax = 'F'
-		else:
-			raise Exception("unknown array syntax " + syntax)
\ No newline at end of file
+		syntax = text.PlainStringContext(self.args[0], context).parse()
+		context.settings = context.settings.replace(arraysyntax = normalize(syntax))
+
+
+# The setting for the array syntax called name, C or F
+def normalize(name):
+	syntax = name.strip().upper()
+
+	if syntax == 'C':
+		return 'C'
+	elif syntax == 'F' or syntax == 'F90' or syntax == 'FORTRAN':
+		return 'F'
+	else:
+		raise Exception("unknown array syntax " + syntax)
\ No newline at end of file
@@ -1,9 +1,13 @@
+import abc
 import tag
 import parser
 import text
 import arrayexpand
 import num
-from stencil import StencilDefinition
+import invariant
+import looped
+from itertools import izip
+from stencil import StencilDefinition, Offset
 
 def token_class():
 	return D1TagToken
@@ -41,30 +45,147 @@ class D1TagToken(tag.TagToken):
 			dindices = [d1index]
 
 			inner_context = DerivativeParsingContext(self.args[0], context, dindices)
-			(dpointblocks, exprblock) = inner_context.parse()
-			return FirstDerivativeBlock(stencils, dindices, dpointblocks, exprblock)
+			(dpoints, exprblock) = inner_context.parse()
+			return FirstDerivativeBlock(stencils, dindices, dpoints, exprblock, context.settings.pointenv, strategy(self, context))
 
 
 # dindex means the grx variable which holds the index of the coordinate being differentiated with respect to (i.e. the index of the partial differential operator)
-# dpointblock means the parser block which holds the string for the current stencil point
+# dpoint means the StencilPoint which holds the Offset of the current stencil point
 # exprblock means the parser block which holds the expression being differentiated
+# pointenv means the @pointscope which holds a temporary for the expression at each stencil point, if any
 
-class FirstDerivativeBlock(parser.AbstractBlock):
+# strategy means the looped.Strategy which decides whether the derivative is unrolled or emitted as a loop
 
-	def __init__(self, stencils, dindices, dpointblocks, exprblock):
-		self.stencil = stencils[0]
-		# self.dindices = We don't need to inspect dindices for first derivative
-		self.dpointblock = dpointblocks[0]
+'''
+The rendering shared by the derivative tags, which give the terms of the derivative for the values of their indices
+'''
+class DerivativeBlock(parser.AbstractBlock):
+
+	# a subclass which doesn't define terms() can't be instantiated
+	__metaclass__ = abc.ABCMeta
+
+	def __init__(self, dindices, dpoints, exprblock, pointenv = None, strategy = None):
+		self.dindices = dindices
+		self.dpoints = dpoints
 		self.exprblock = exprblock
+		self.body = invariant.hoist(exprblock, dpoints)
+		self.pointenv = pointenv
+		self.strategy = strategy
+
+	def dependencies(self):
+		dependencies = parser.dependencies(self.dindices + [self.exprblock])
+		if dependencies is None or self.pointenv is not None:
+			# declaring temporaries in a @pointscope is a side effect
+			return None
+		else:
+			return dependencies - frozenset(self.dpoints)
+
+	# Return a list of (tuple of an Offset for each of dpoints, text preceding the expression, weight) for each term,
+	# which is empty if all the weights are zero
+	@abc.abstractmethod
+	def terms(self, *indices):
+		pass
+
+	# Whether to emit the derivative as a loop rather than unrolled, see looped.py
+	def looped(self, frame, terms, indices):
+		return self.strategy is not None and self.strategy.choose(frame, self, terms, indices)
+
+	def write_looped(self, out, frame, terms, indices):
+		self.strategy.write(out, frame, self, terms, indices)
+
+	def write(self, out, frame):
+		indices = tuple([dindex.numvalue(frame) for dindex in self.dindices])
+		terms = self.terms(*indices)
+
+		if self.looped(frame, terms, indices):
+			self.write_looped(out, frame, terms, indices)
+			return
+
+		out.write('( ')
+		if not terms:
+			out.write('0')
+
+		for (offsets, prefix, weight) in terms:
+			for (dpoint, offset) in izip(self.dpoints, offsets):
+				frame[dpoint.slot] = offset
+			out.write(prefix)
+			write_point(out, frame, self.body, self.pointenv)
+			out.write(')')
+
+		out.write(' )')
+
+	def compile(self, gen):
+		if gen.too_deep():
+			gen.helper(self)
+			return
+
+		indices = gen.newname('_i')
+		terms = gen.newname('_t')
+		gen.statement('%s = (%s)' % (indices, ''.join([dindex.compile_value(gen) + ', ' for dindex in self.dindices])))
+		gen.statement('%s = %s.terms(*%s)' % (terms, gen.constant(self), indices))
+
+		gen.statement('if %s.looped(%s, %s, %s):' % (gen.constant(self), gen.frame(), terms, indices))
+		gen.indent()
+		gen.store_bindings()
+		gen.statement('%s.write_looped(%s, %s, %s, %s)' % (gen.constant(self), gen.output(), gen.frame(), terms, indices))
+		gen.dedent()
+
+		gen.statement('else:')
+		gen.indent()
+		gen.literal('( ')
+		gen.statement('if not %s:' % terms)
+		gen.indent()
+		gen.literal('0')
+		gen.dedent()
+
+		points = [gen.bind(dpoint, '_p') for dpoint in self.dpoints]
+		prefix = gen.newname('_t')
+
+		gen.begin_loop('for (%s), %s, _ in %s:' % (''.join([point + ', ' for point in points]), prefix, terms))
+		gen.write(prefix)
+		compile_point(gen, self.body, self.pointenv)
+		gen.literal(')')
+		gen.end_loop()
+
+		for dpoint in self.dpoints:
+			gen.unbind(dpoint)
+		gen.literal(' )')
+		gen.dedent()
 
-	def execute(self):
-		terms = []
+
+class FirstDerivativeBlock(DerivativeBlock):
+
+	def __init__(self, stencils, dindices, dpoints, exprblock, pointenv = None, strategy = None):
+		DerivativeBlock.__init__(self, dindices, dpoints, exprblock, pointenv, strategy)
+		self.stencil = stencils[0]
+
+		# the terms don't depend on the index
+		self._terms = []
 		for (point, weight) in self.stencil:
-			self.dpointblock.content = point
-			terms.append('(%s) * (%s)' % (weight, self.exprblock.execute()))
+			separator = ' + ' if self._terms else ''
+			self._terms.append(((Offset.get(point), ), separator + '(' + weight + ') * (', '(' + weight + ')'))
+
+	def terms(self, *indices):
+		return self._terms
+
 
-		from string import join
-		return '( ' + join(terms, ' + ') + ' )'
+# The looped.Strategy of the derivative tag token, which takes the limit set by @unroll
+def strategy(token, context):
+	return looped.Strategy((token.line, token.char, '@' + token.name), context.settings.unroll, context.settings.arraysyntax)
+
+
+# Render the expression at a stencil point, or the name of the temporary holding it in a @pointscope
+def write_point(out, frame, exprblock, pointenv):
+	if pointenv is None:
+		exprblock.write(out, frame)
+	else:
+		pointenv.write_point(out, frame, exprblock)
+
+def compile_point(gen, exprblock, pointenv):
+	if pointenv is None:
+		exprblock.compile(gen)
+	else:
+		pointenv.compile_point(gen, exprblock)
 
 
 class DerivativeParsingContext(parser.ParsingContext):
@@ -72,38 +193,73 @@ class DerivativeParsingContext(parser.ParsingContext):
 	def __init__(self, tokens, context, dindices):
 		parser.ParsingContext.__init__(self, tokens, context)
 		self.dindices = dindices
-		self.dpointblocks = [text.TextBlock('') for dindex in dindices]
+		self.dpoints = [StencilPoint(self.scope) for dindex in dindices]
 
 	def parse_all(self):
-		return (self.dpointblocks, parser.ParsingContext.parse_all(self))
+		return (self.dpoints, parser.ParsingContext.parse_all(self))
 
 	def parse_token(self, token):
 		if isinstance(token, arrayexpand.ArrayExpandToken):
 			iterblock = token.parse(self);
 			rawcontent = iterblock.content
-			deltablock = DerivativeDeltaBlock(iterblock.counter, self.dindices, self.dpointblocks)
-			iterblock.content = parser.BlockSequence([rawcontent, deltablock])
+			deltablock = DerivativeDeltaBlock(iterblock.counter, self.dindices, self.dpoints)
+			iterblock.set_content(parser.BlockSequence([rawcontent, deltablock]))
 			return iterblock
 		else:
 			return parser.ParsingContext.parse_token(self, token)
 
 
+# The Offset of the stencil point currently being rendered by a derivative block, kept in the render frame
+class StencilPoint(object):
+
+	def __init__(self, scope):
+		self.slot = scope.allocate(self)
+
+	def dependencies(self):
+		return frozenset([self])
+
+	def value(self, frame):
+		return frame[self.slot]
+
+	def compile_value(self, gen):
+		name = gen.lookup(self)
+		if name is None:
+			return '%s[%d]' % (gen.frame(), self.slot)
+		else:
+			return name
+
+	def compile_store(self, gen, name):
+		gen.statement('%s[%d] = %s' % (gen.frame(), self.slot, name))
+
+
+# Writes the offset of the current stencil point along the dimension of an array expansion, if it is differentiated
 class DerivativeDeltaBlock(parser.AbstractBlock):
 
-	def __init__(self, index_counter, dindices, dpointblocks):
+	def __init__(self, index_counter, dindices, dpoints):
 		self.index_counter = index_counter
 		self.dindices = dindices
-		self.dpointblocks = dpointblocks
-
-	def execute(self):
-		from itertools import izip
-		for (dindex, dpointblock) in izip(self.dindices, self.dpointblocks):
-			if self.index_counter.numvalue() == dindex.numvalue():
-				# TODO: fix this temporary hack!
-				rawstring = dpointblock.execute()
-				from string import join
-				return ' + (' + join(rawstring.split('#'), self.index_counter.execute()) + ')'
-				# end hack
+		self.dpoints = dpoints
+
+	def dependencies(self):
+		return parser.dependencies([self.index_counter] + self.dindices + self.dpoints)
+
+	def execute(self, frame):
+		index = self.index_counter.numvalue(frame)
+		for (dindex, dpoint) in izip(self.dindices, self.dpoints):
+			if index == dindex.numvalue(frame):
+				return dpoint.value(frame).text(index)
 
 		return ''
 
+	def compile(self, gen):
+		index = self.index_counter.compile_value(gen)
+		keyword = 'if'
+
+		for (dindex, dpoint) in izip(self.dindices, self.dpoints):
+			point = dpoint.compile_value(gen)
+			gen.statement('%s %s == %s:' % (keyword, index, dindex.compile_value(gen)))
+			gen.indent()
+			gen.write('%s.text(%s)' % (point, index))
+			gen.dedent()
+			keyword = 'elif'
+
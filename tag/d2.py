@@ -3,7 +3,7 @@ import parser
 import text
 import num
 import d1
-from stencil import StencilDefinition
+from stencil import StencilDefinition, Offset
 
 def token_class():
 	return D1TagToken
@@ -47,46 +47,44 @@ class D1TagToken(tag.TagToken):
 			dindices = [d1index, d2index]
 
 			inner_context = d1.DerivativeParsingContext(self.args[0], context, dindices)
-			(dpointblocks, exprblock) = inner_context.parse()
-			return SecondDerivativeBlock(stencils, dindices, dpointblocks, exprblock)
+			(dpoints, exprblock) = inner_context.parse()
+			return SecondDerivativeBlock(stencils, dindices, dpoints, exprblock, context.settings.pointenv, d1.strategy(self, context))
 
 # dindex means the grx variable which holds the index of the coordinate being differentiated with respect to (i.e. the index of the partial differential operator)
-# dpointblock means the parser block which holds the string for the current stencil point
+# dpoint means the StencilPoint which holds the Offset of the current stencil point
 # exprblock means the parser block which holds the expression being differentiated
+# pointenv means the @pointscope which holds a temporary for the expression at each stencil point, if any
+# strategy means the looped.Strategy which decides whether the derivative is unrolled or emitted as a loop
 
-class SecondDerivativeBlock(parser.AbstractBlock):
+class SecondDerivativeBlock(d1.DerivativeBlock):
 
-	def __init__(self, stencils, dindices, dpointblocks, exprblock):
+	def __init__(self, stencils, dindices, dpoints, exprblock, pointenv = None, strategy = None):
+		d1.DerivativeBlock.__init__(self, dindices, dpoints, exprblock, pointenv, strategy)
 		self.stencils = stencils
-		self.dindices = dindices
-		self.dpointblocks = dpointblocks
-		self.exprblock = exprblock
 
-	def execute(self):
-		terms = []
-
-		index1 = self.dindices[0].numvalue()
-		index2 = self.dindices[1].numvalue()
-		
+		# the terms for index1 == index2, index1 < index2 and index1 > index2, worked out here rather than while
+		# rendering so that the block never changes once parsed
+		diagonal = []
+		for (point, weight) in self.stencils[1]:
+			separator = ' + ' if diagonal else ''
+			diagonal.append(((Offset.get(point), Offset.get(point)), separator + '(' + weight + ') * (', '(' + weight + ')'))
+
+		# off-diagonal, product of the first derivative stencil with itself, with the terms at the same point combined
+		# and those with a zero weight left out
+		lower = []
+		upper = []
+		for ((point1, point2), coefficient) in self.stencils[0].product(self.stencils[0]):
+			separator = ' + ' if lower else ''
+			prefix = separator + coefficient + ' * ('
+			lower.append(((Offset.get(point1), Offset.get(point2)), prefix, coefficient))
+			upper.append(((Offset.get(point2), Offset.get(point1)), prefix, coefficient))
+
+		self._terms = (diagonal, lower, upper)
+
+	def terms(self, index1, index2):
 		if index1 == index2:
-			# diagonal, use second derivative stencil
-			for (point, weight) in self.stencils[1]:
-				self.dpointblocks[0].content = point
-				self.dpointblocks[1].content = point
-				terms.append('(%s) * (%s)' % (weight, self.exprblock.execute()))
-
+			return self._terms[0]
+		elif index1 < index2:
+			return self._terms[1]
 		else:
-			# off-diagonal, double loop over first derivative stencil
-			for (point1, weight1) in self.stencils[0]:
-				for (point2, weight2) in self.stencils[0]:
-					if index1 < index2:
-						self.dpointblocks[0].content = point1
-						self.dpointblocks[1].content = point2
-					else:
-						self.dpointblocks[0].content = point2
-						self.dpointblocks[1].content = point1
-
-					terms.append('(%s) * (%s) * (%s)' % (weight1, weight2, self.exprblock.execute()))
-
-		from string import join
-		return '( ' + join(terms, ' + ') + ' )'
+			return self._terms[2]
@@ -19,4 +19,4 @@ class DefaultRangeTagToken(tag.TagToken):
 
 		context.declare('RANGEMIN', minvar)
 		context.declare('RANGEMAX', maxvar)
-		context.defaultrange = [minvar, maxvar]
+		context.settings = context.settings.replace(defaultrange = [minvar, maxvar])
@@ -15,18 +15,17 @@ class DefineTagToken(tag.TagToken):
 			raise Exception("@define expects exactly two arguments")
 			
 		else:
-			try:
-				env = context._defineenv
-			except AttributeError:
+			env = context.settings.defineenv
+			if env is None:
 				raise Exception("cannot use @define outside of a @definescope")
 
 			matchblock = parser.ParsingContext(self.args[0], context).parse()
 			replaceblock = parser.ParsingContext(self.args[1], context).parse()
-			return substitution.DefinitionBlock(env, matchblock, replaceblock)	
+			return substitution.DefinitionBlock(env, matchblock, replaceblock, (self.line, self.char))
 			
 
 class DefineScopeContext(tag.ExtendedTagContext):
 
 	def __init__(self, tokens, parent, tag):
 		tag.ExtendedTagContext.__init__(self, tokens, parent, tag)
-		self.env = substitution.SubstitutionEnvironment()
+		self.env = substitution.SubstitutionEnvironment(self.scope.allocate())
@@ -1,4 +1,5 @@
 import tag
+import text
 import iteration
 import substitution
 
@@ -8,14 +9,32 @@ def token_class():
 
 class DefineScopeTagToken(tag.TagToken):
 
+	# @definescope[[mode]] selects how the @defines inside it are applied
+	modes = {
+		'': substitution.Mode.PRAGMA,
+		'pragma': substitution.Mode.PRAGMA,
+		'replace': substitution.Mode.REPLACE,
+	}
+
 	def parse(self, context):
-		inner_context = DefineScopeContext(iter(context), context, self)
+		if len(self.args) > 1:
+			raise Exception("@definescope expects at most one argument")
+
+		mode = substitution.Mode.PRAGMA
+		if len(self.args) == 1:
+			modename = text.PlainStringContext(self.args[0], context).parse().strip().lower()
+			if modename not in DefineScopeTagToken.modes:
+				raise Exception("unknown @definescope mode '" + modename + "'")
+			mode = DefineScopeTagToken.modes[modename]
+
+		inner_context = DefineScopeContext(iter(context), context, self, mode)
 		content = inner_context.parse()
-		return substitution.SubstitutionBlock(inner_context._defineenv, content)
+		return substitution.SubstitutionBlock(inner_context.env, content)
 
 
 class DefineScopeContext(tag.ExtendedTagContext):
 
-	def __init__(self, tokens, parent, tagtoken):
+	def __init__(self, tokens, parent, tagtoken, mode = substitution.Mode.PRAGMA):
 		tag.ExtendedTagContext.__init__(self, tokens, parent, tagtoken)
-		self._defineenv = substitution.SubstitutionEnvironment(substitution.Mode.PRAGMA)
+		self.env = substitution.SubstitutionEnvironment(self.scope.allocate(), mode)
+		self.settings = self.settings.replace(defineenv = self.env)
@@ -0,0 +1,99 @@
+import tag
+import text
+import num
+import d1
+from stencil import StencilDefinition, Offset
+
+def token_class():
+	return DnTagToken
+
+
+class DnTagToken(tag.TagToken):
+
+	def parse(self, context):
+
+		if len(self.args) < 3 or len(self.args) % 2 == 0:
+			raise Exception("@dn expects an expression, followed by n derivative indices and n stencils")
+
+		else:
+			n = (len(self.args) - 1) // 2
+
+			# read derivative operator indices
+			dindices = []
+			for arg in self.args[1:n + 1]:
+				try:
+					dindexstring = text.PlainStringContext(arg, context).parse().strip()
+				except Exception, e:
+					raise Exception("invalid derivative index")
+				dindices.append(num.fromstring(dindexstring, context))
+
+			# read stencil names, the m-th is used for m repeated derivatives and may be left empty if there are none
+			stencils = []
+			for arg in self.args[n + 1:]:
+				try:
+					stencilname = text.PlainStringContext(arg, context).parse().strip()
+				except Exception, e:
+					raise Exception("invalid stencil name")
+
+				if stencilname == '':
+					stencils.append(None)
+					continue
+
+				stencil = context.getvar(stencilname)
+				if not isinstance(stencil, StencilDefinition):
+					raise ValueError("'" + stencilname + "' is not a @stencil")
+				stencils.append(stencil)
+
+			inner_context = d1.DerivativeParsingContext(self.args[0], context, dindices)
+			(dpoints, exprblock) = inner_context.parse()
+			return NthDerivativeBlock(stencils, dindices, dpoints, exprblock, context.settings.pointenv, d1.strategy(self, context))
+
+# dindex means the grx variable which holds the index of the coordinate being differentiated with respect to (i.e. the index of the partial differential operator)
+# dpoint means the StencilPoint which holds the Offset of the current stencil point
+# exprblock means the parser block which holds the expression being differentiated
+# pointenv means the @pointscope which holds a temporary for the expression at each stencil point, if any
+# strategy means the looped.Strategy which decides whether the derivative is unrolled or emitted as a loop
+
+'''
+A derivative of any order. The derivatives along the same coordinate are taken together with the stencil for that
+many repeated derivatives, and those along different coordinates are combined by the tensor product of their
+stencils. The product is worked out once for each combination of stencils (see StencilDefinition.product), whatever
+order the indices come in, so d_ij and d_ji share one expansion.
+'''
+class NthDerivativeBlock(d1.DerivativeBlock):
+
+	def __init__(self, stencils, dindices, dpoints, exprblock, pointenv = None, strategy = None):
+		d1.DerivativeBlock.__init__(self, dindices, dpoints, exprblock, pointenv, strategy)
+		self.stencils = stencils
+		# the terms by the groups of positions of equal indices, filled in as each is first rendered since there are
+		# too many ways for the indices to coincide to work them all out when parsing, see parser.AbstractBlock
+		self._terms = {}
+
+	def terms(self, *indices):
+		# the positions of the indices along each coordinate, in order of the coordinates
+		groups = {}
+		for (position, index) in enumerate(indices):
+			groups.setdefault(index, []).append(position)
+		groups = tuple([tuple(groups[index]) for index in sorted(groups)])
+
+		if groups not in self._terms:
+			stencils = []
+			for group in groups:
+				stencil = self.stencils[len(group) - 1]
+				if stencil is None:
+					raise Exception("@dn has no stencil for " + str(len(group)) + " repeated derivatives")
+				stencils.append(stencil)
+
+			terms = []
+			for (points, coefficient) in stencils[0].product(*stencils[1:]):
+				separator = ' + ' if terms else ''
+				# every point along a coordinate gets the same offset, only the first one is ever read
+				dpoints = [None] * len(indices)
+				for (group, point) in zip(groups, points):
+					for position in group:
+						dpoints[position] = Offset.get(point)
+				terms.append((tuple(dpoints), separator + coefficient + ' * (', coefficient))
+
+			self._terms[groups] = terms
+
+		return self._terms[groups]
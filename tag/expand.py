@@ -11,16 +11,15 @@ def token_class():
 class AbstractExpandToken(lexer.AbstractToken):
 
 	def parse(self, context):
-		try:
-			start = context.defaultrange[0]
-			end = context.defaultrange[1]
-		except AttributeError:
+		if context.settings.defaultrange is None:
 			raise Exception("expansion directive requires a previously declared @defaultrange")
 
+		(start, end) = context.settings.defaultrange
+
 		counter = iteration.IterationCounter(start, end)
 
 		inner_context = SimpleExpansionContext(self._rawcontent, context)
-		inner_context.declare(counter.uniquename(), counter)
+		counter.slot = inner_context.declare(counter.uniquename(), counter)
 		inner_context.countername = counter.uniquename()
 
 		content = inner_context.parse()
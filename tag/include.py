@@ -0,0 +1,33 @@
+import tag
+import text
+import library
+
+def token_class():
+	return IncludeTagToken
+
+
+class IncludeTagToken(tag.TagToken):
+
+	# Declare the variables of the library in this context, change its settings the same way, and output its text
+	def parse(self, context):
+		if len(self.args) != 1:
+			raise ValueError("@include takes exactly one argument")
+
+		path = text.PlainStringContext(self.args[0], context).parse().strip()
+		if path == '':
+			raise ValueError("@include expects the path of a file")
+
+		includes = context.settings.includes
+		if includes is None:
+			includes = library.Includes()
+
+		included = library.load(path, includes)
+		for (name, variable) in included.variables:
+			# including the same library twice is harmless
+			if context.getvar(name) is not variable:
+				context.declare(name, variable)
+		if included.settings:
+			context.settings = context.settings.replace(**included.settings)
+
+		if included.text != '':
+			return text.TextBlock(included.text)
@@ -1,4 +1,5 @@
 import tag
+import tag.pointscope
 import iteration
 
 def token_class():
@@ -21,10 +22,13 @@ class AbstractIteratorToken(tag.TagToken):
 	
 		for arg in self.args:
 			rangespec = iteration.RangeSpecContext(arg, inner_context).parse()
-			inner_context.declare(rangespec.name, rangespec.counter)
+			rangespec.counter.slot = inner_context.declare(rangespec.name, rangespec.counter)
 			counters.append(rangespec.counter)
 		
+		size = len(inner_context.scope.slots)
 		content = inner_context.parse()
+		# whether the content declared a @pointscope, see IterationBlock.ordered
+		self.ordered = any(isinstance(obj, tag.pointscope.PointEnvironment) for obj in inner_context.scope.slots[size:])
 
 		return (counters, content)
 
@@ -48,5 +52,6 @@ class IterateTagToken(AbstractIteratorToken):
 		block = content
 		for counter in reversed(counters):
 			block = iteration.IterationBlock(counter, block)
+			block.ordered = self.ordered
 
 		return block
@@ -0,0 +1,122 @@
+import tag
+import text
+import parser
+
+def token_class():
+	return PointScopeTagToken
+
+
+class PointScopeTagToken(tag.TagToken):
+
+	def parse(self, context):
+		if len(self.args) > 2:
+			raise Exception("@pointscope expects at most two arguments")
+
+		settings = [text.PlainStringContext(arg, context).parse().strip() for arg in self.args]
+		settings = settings + [''] * (2 - len(settings))
+
+		vartype = settings[0] or 'const double'
+		prefix = settings[1] or 'grx_point'
+
+		m = parser.valid_varname.match(prefix)
+		if (not m) or (m.group(0) != prefix):
+			raise ValueError("invalid @pointscope name prefix '" + prefix + "'")
+
+		inner_context = PointScopeContext(iter(context), context, self, vartype, prefix)
+		content = inner_context.parse()
+		return PointScopeBlock(inner_context.env, content)
+
+
+class PointScopeContext(tag.ExtendedTagContext):
+
+	def __init__(self, tokens, parent, tagtoken, vartype, prefix):
+		tag.ExtendedTagContext.__init__(self, tokens, parent, tagtoken)
+		# the number of @pointscopes with the same prefix earlier in the document, see PointEnvironment.stem
+		ordinal = len([obj for obj in self.scope.slots if isinstance(obj, PointEnvironment) and obj.prefix == prefix])
+		self.env = PointEnvironment(vartype, prefix, ordinal)
+		self.env.slot = self.scope.allocate(self.env)
+		self.settings = self.settings.replace(pointenv = self.env)
+
+
+'''
+Declares a temporary for each distinct expression which a @d1 or @d2 inside the scope evaluates at a stencil point
+
+The derivatives refer to the temporaries by name, so each neighbour value is loaded once however many derivatives use
+it. The declarations can only be written once the whole scope has been rendered, so they go at its start.
+
+The names have to be unique in the whole output, since the scopes needn't be in blocks of their own in the generated
+code. A scope rendered again in the same frame, e.g. inside an @iterate, numbers its temporaries on from where the
+last render stopped, and scopes after the first with the same prefix put their ordinal in the names as well. Counting
+in the order things are rendered across the whole document would instead give different names when top level blocks
+are rendered on their own, with --jobs or --watch.
+'''
+class PointScopeBlock(parser.AbstractBlock):
+
+	def __init__(self, env, content):
+		self.env = env
+		self.content = content
+
+	def write(self, out, frame):
+		table = self.env.begin(frame)
+		content = self.content.execute(frame)
+		out.write(self.env.declarations(table))
+		out.write(content)
+
+	def compile(self, gen):
+		table = gen.newname('_v')
+		gen.statement('%s = %s.begin(%s)' % (table, gen.constant(self.env), gen.frame()))
+		content = gen.capture(self.content)
+		gen.write('%s.declarations(%s)' % (gen.constant(self.env), table))
+		gen.write(content)
+
+
+# The temporaries of one @pointscope, kept in the render frame under the slot allocated by the parser
+class PointEnvironment(object):
+
+	def __init__(self, vartype, prefix, ordinal = 0):
+		self.slot = None
+		self.vartype = vartype
+		self.prefix = prefix
+		# what the names of the temporaries start with, e.g. grx_point0, ... or in a later scope grx_point1_0, ...
+		self.stem = prefix if ordinal == 0 else prefix + str(ordinal) + '_'
+
+	# Start a new list of temporaries for this render of the scope, numbered on from the last one in the frame
+	def begin(self, frame):
+		previous = frame.get(self.slot)
+		table = frame[self.slot] = PointTable(previous.end() if previous is not None else 0)
+		return table
+
+	def declarations(self, table):
+		return ''.join(['\n' + self.vartype + ' ' + name + ' = ' + expression + ';' for (expression, name) in table])
+
+	# Write the name of the temporary holding the expression rendered by block
+	def write_point(self, out, frame, block):
+		out.write(frame[self.slot].name(self.stem, block.execute(frame)))
+
+	def compile_point(self, gen, block):
+		expression = gen.capture(block)
+		gen.write('%s[%d].name(%r, %s)' % (gen.frame(), self.slot, self.stem, expression))
+
+
+# The temporaries declared so far, in order
+class PointTable(object):
+
+	def __init__(self, start = 0):
+		self._start = start
+		self._names = {}
+		self._order = []
+
+	def __iter__(self):
+		return iter(self._order)
+
+	# The number of the next temporary
+	def end(self):
+		return self._start + len(self._order)
+
+	def name(self, stem, expression):
+		expression = expression.strip()
+		if expression not in self._names:
+			name = stem + str(self.end())
+			self._names[expression] = name
+			self._order.append((expression, name))
+		return self._names[expression]
@@ -1,6 +1,10 @@
+import re
+import itertools
 import parser
 import text
 import tag
+import fornberg
+from fractions import Fraction
 
 def token_class():
 	return StencilTagToken
@@ -34,6 +38,7 @@ class StencilDefinition(parser.AbstractVariable):
 			self.points = points
 			self.weights = weights
 			self._len = len(self.points)
+			self._products = {}
 
 	def __len__(self):
 		return self._len
@@ -42,17 +47,35 @@ class StencilDefinition(parser.AbstractVariable):
 		from itertools import izip
 		return izip(self.points, self.weights)
 
+	# Return the tensor product of this stencil with others, as a list of (tuple of points, coefficient) folded by
+	# fold(). Each product is only worked out once.
+	def product(self, *others):
+		if others not in self._products:
+			terms = []
+			for combination in itertools.product(self, *others):
+				terms.append((tuple([point for (point, weight) in combination]), [weight for (point, weight) in combination]))
+			self._products[others] = fold(terms)
+		return self._products[others]
+
 
 class StencilContext(parser.ParsingContext):
 
+	sides = ['central', 'forward', 'backward']
+
 	def __init__(self, *args, **kwargs):
 		parser.ParsingContext.__init__(self, *args, **kwargs)
 		self.points = None
 		self.weights = None
+		self.derivative = None
 
 	def parse_all(self):
 		parser.ParsingContext.parse_all(self)
 
+		if self.derivative is not None:
+			if self.weights:
+				raise Exception("@weights cannot be given along with @derivative")
+			(self.points, self.weights) = self.generate(*self.derivative)
+
 		if not self.points:
 			raise Exception("@points not defined for this @stencil")
 
@@ -72,6 +95,9 @@ class StencilContext(parser.ParsingContext):
 			elif token.name == 'weights':
 				self.weights = self.parse_args(token.args)
 
+			elif token.name == 'derivative':
+				self.derivative = self.parse_derivative(token.args)
+
 			elif token.name == 'end':
 				raise parser.LeaveContext
 
@@ -88,4 +114,221 @@ class StencilContext(parser.ParsingContext):
 		parsed_args = []
 		for arg in args:
 			parsed_args.append(text.PlainStringContext(arg, self).parse().strip())
-		return parsed_args			
+		return parsed_args
+
+	# Return (order, accuracy, side) from the arguments of @derivative, with None for those not given
+	def parse_derivative(self, args):
+		if len(args) < 1 or len(args) > 3:
+			raise Exception("@derivative expects one to three arguments")
+
+		args = self.parse_args(args) + [''] * (3 - len(args))
+		try:
+			order = int(args[0])
+			accuracy = int(args[1]) if args[1] else None
+		except ValueError:
+			raise ValueError("the orders given to @derivative must be integers")
+
+		if order < 1 or (accuracy is not None and accuracy < 1):
+			raise ValueError("the orders given to @derivative must be positive")
+
+		side = args[2] or None
+		if side is not None and side not in StencilContext.sides:
+			raise ValueError("unknown @derivative side '" + side + "', expected one of " + ', '.join(StencilContext.sides))
+
+		return (order, accuracy, side)
+
+	# Return the points and weights of the stencil for the derivative of the given order, which uses either the
+	# @points given or the fewest needed for the accuracy on the given side. Points with a zero weight are left out.
+	def generate(self, order, accuracy, side):
+		if self.points:
+			if accuracy is not None or side is not None:
+				raise Exception("@derivative takes an accuracy order only when @points is omitted")
+			try:
+				offsets = [Fraction(point) for point in self.points]
+			except ValueError:
+				raise ValueError("@derivative needs @points which are numbers")
+
+		elif accuracy is None:
+			raise Exception("@derivative needs either @points or an accuracy order")
+
+		elif side is None or side == 'central':
+			if accuracy % 2 != 0:
+				raise ValueError("central stencils have an even accuracy order")
+			# the fewest points around zero which reach the accuracy
+			half = (order + 1) // 2 - 1 + accuracy // 2
+			offsets = range(-half, half + 1)
+
+		elif side == 'forward':
+			offsets = range(0, order + accuracy)
+
+		else:
+			offsets = range(-(order + accuracy) + 1, 1)
+
+		names = self.points or [str(offset) for offset in offsets]
+		points = []
+		weights = []
+		for (name, weight) in zip(names, fornberg.weights(order, offsets)):
+			if weight != 0:
+				points.append(name)
+				weights.append(literal(weight))
+		return (points, weights)
+
+
+'''
+The text which moves an array index along one dimension to a stencil point, e.g. ' + (-1)'
+
+A point may refer to the dimension as #, so the text for each dimension is worked out the first time it is needed and
+then kept. There is one Offset for each distinct point, shared by every stencil using it. Its texts never change once
+made, so derivative blocks keep Offsets rather than points in the render frame and share them between renders.
+'''
+class Offset(object):
+
+	instances = {}
+
+	def __init__(self, point):
+		self.point = point
+		self._parts = point.split('#')
+		self._texts = {}
+
+	@staticmethod
+	def get(point):
+		try:
+			return Offset.instances[point]
+		except KeyError:
+			offset = Offset.instances[point] = Offset(point)
+			return offset
+
+	def text(self, dimension):
+		try:
+			return self._texts[dimension]
+		except KeyError:
+			text = self._texts[dimension] = ' + (' + str(dimension).join(self._parts) + ')'
+			return text
+
+
+# A weight as a floating point literal, e.g. 1/12.
+def literal(fraction):
+	if fraction.denominator == 1:
+		return str(fraction.numerator) + '.'
+	else:
+		return str(fraction.numerator) + '/' + str(fraction.denominator) + '.'
+
+
+# Combine the terms of a weighted sum which are taken at the same points, and drop those whose weight is zero
+# terms is a list of (points, weights), where the weights of a term are multiplied together. Returns a list of
+# (points, coefficient) in the order the points first appear, with the coefficient written out as a product or a sum
+# of products of the weights as given.
+def fold(terms):
+	order = []
+	products = {}
+
+	for (points, weights) in terms:
+		key = tuple([point.strip() for point in points])
+		if key not in products:
+			order.append((key, points))
+			products[key] = []
+
+		# the value of the product, None if it isn't known
+		values = [value_of(weight) for weight in weights]
+		if 0 in values:
+			value = Fraction(0)
+		elif None in values:
+			value = None
+		else:
+			value = reduce(lambda x, y: x * y, values, Fraction(1))
+		products[key].append((' * '.join(['(' + weight + ')' for weight in weights]), value))
+
+	folded = []
+	for (key, points) in order:
+		# a product known to be zero adds nothing, nor does a sum of products known to add up to zero
+		nonzero = [(product, value) for (product, value) in products[key] if value != 0]
+		values = [value for (product, value) in nonzero]
+		if len(nonzero) == 0 or (None not in values and sum(values) == 0):
+			continue
+
+		if len(nonzero) == 1:
+			coefficient = nonzero[0][0]
+		else:
+			coefficient = '(' + ' + '.join([product for (product, value) in nonzero]) + ')'
+		folded.append((points, coefficient))
+
+	return folded
+
+
+_number = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)([eEdD][-+]?\d+)?|([-+*/()]))")
+
+# The value of a weight made up of number literals and + - * / ( ) as the C or Fortran compiler would evaluate it,
+# with / between integers truncating towards zero, or None if the weight is anything else
+def value_of(weight):
+	tokens = []
+	position = 0
+	weight = weight.rstrip()
+	while position < len(weight):
+		m = _number.match(weight, position)
+		if m is None:
+			return None
+		if m.group(3) is not None:
+			tokens.append(m.group(3))
+		else:
+			mantissa = Fraction(m.group(1))
+			if m.group(2) is not None:
+				mantissa = mantissa * Fraction(10) ** int(m.group(2)[1:])
+			# the value, and whether it is an integer as far as the compiler is concerned
+			tokens.append((mantissa, m.group(2) is None and '.' not in m.group(1)))
+		position = m.end()
+
+	tokens.reverse()
+	try:
+		value = _sum(tokens)[0]
+	except (IndexError, ValueError, ZeroDivisionError):
+		return None
+
+	if tokens:
+		return None
+	return value
+
+def _sum(tokens):
+	(value, integer) = _product(tokens)
+	while tokens and tokens[-1] in ('+', '-'):
+		operator = tokens.pop()
+		(right, right_integer) = _product(tokens)
+		if operator == '+':
+			value = value + right
+		else:
+			value = value - right
+		integer = integer and right_integer
+	return (value, integer)
+
+def _product(tokens):
+	(value, integer) = _factor(tokens)
+	while tokens and tokens[-1] in ('*', '/'):
+		operator = tokens.pop()
+		(right, right_integer) = _factor(tokens)
+		if operator == '*':
+			value = value * right
+		elif integer and right_integer:
+			quotient = abs(value) // abs(right)
+			if (value < 0) != (right < 0):
+				quotient = -quotient
+			value = Fraction(quotient)
+		else:
+			value = value / right
+		integer = integer and right_integer
+	return (value, integer)
+
+def _factor(tokens):
+	token = tokens.pop()
+	if token == '-':
+		(value, integer) = _factor(tokens)
+		return (-value, integer)
+	elif token == '+':
+		return _factor(tokens)
+	elif token == '(':
+		result = _sum(tokens)
+		if tokens.pop() != ')':
+			raise ValueError
+		return result
+	elif isinstance(token, tuple):
+		return token
+	else:
+		raise ValueError
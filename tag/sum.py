@@ -26,5 +26,6 @@ class SumTagToken(iterate.AbstractIteratorToken):
 		block = BlockSequence([TextBlock('('), content, TextBlock(')')])
 		for counter in reversed(counters):
 			block = IterationBlock(counter, block, before = '(', between = ' + ', after = ')')
+			block.ordered = self.ordered
 		
 		return block
@@ -0,0 +1,25 @@
+import tag
+import text
+
+def token_class():
+	return UnrollTagToken
+
+
+class UnrollTagToken(tag.TagToken):
+	def parse(self, context):
+		if len(self.args) != 1:
+			raise ValueError("@unroll takes exactly one argument")
+
+		string = text.PlainStringContext(self.args[0], context).parse().strip()
+
+		if string.lower() == 'all':
+			context.settings = context.settings.replace(unroll = None)
+		else:
+			try:
+				limit = int(string)
+				if limit < 0:
+					raise ValueError
+			except ValueError:
+				raise ValueError("@unroll expects a number of terms or all, not '" + string + "'")
+
+			context.settings = context.settings.replace(unroll = limit)
@@ -0,0 +1,97 @@
+import threading
+import lexer
+import parser
+import codegen
+import num
+import library
+from cStringIO import StringIO
+
+'''
+Compile a template once and render it for many settings, for use from Python
+
+	import template
+	t = template.compile(source)
+	t.render(defaultrange = (1, 3), arraysyntax = 'C')
+	t.render_many(defaultranges = [(1, d) for d in range(1, 12)], arraysyntaxes = ['C', 'F'])
+
+The template should leave out @defaultrange and @arraysyntax, which are given to render() instead. The source is
+lexed once. The default range is not bound when parsing: RANGEMIN and RANGEMAX, and every range which leaves out its
+start or end, refer to num.Parameters whose values are only put in the render frame, so one parse and one compiled
+render function serve every range. Array expansions are laid out differently for C and Fortran when they are parsed,
+so the template is parsed once for each array syntax it is rendered with.
+'''
+
+def compile(source, directory = None):
+	return Template(source, directory)
+
+
+class Template(object):
+
+	# directory is where @include looks for files, by default the current directory
+	def __init__(self, source, directory = None):
+		self.directory = directory
+		self._tokens = lexer.lex(source)
+		# the Parsed template by array syntax and whether it has a default range
+		self._parsed = {}
+		self._lock = threading.Lock()
+
+	# Render the template with the default range (start, end) and the array syntax given, e.g. C or Fortran, into out
+	# if given, otherwise return the output as a string. memo and report are as for parser.AbstractBlock.render()
+	def render(self, out = None, defaultrange = None, arraysyntax = None, memo = None, report = None):
+		if out is None:
+			out = StringIO()
+			self.render(out, defaultrange, arraysyntax, memo, report)
+			return out.getvalue()
+
+		if arraysyntax is not None:
+			import tag.arraysyntax
+			arraysyntax = tag.arraysyntax.normalize(arraysyntax)
+
+		parsed = self.parse(arraysyntax, defaultrange is not None)
+		frame = parser.Frame(memo, report)
+		if defaultrange is not None:
+			(start, end) = defaultrange
+			for (parameter, value) in zip(parsed.parameters, (start, end)):
+				if not isinstance(value, (int, long)) or value < 0:
+					raise ValueError("the default range is given by non-negative integers, not " + repr(value))
+				frame[parameter.slot] = value
+
+		parsed.block.write(out, frame)
+
+	# Render the template for every combination of the default ranges and array syntaxes given, return a dict of the
+	# outputs by (default range, array syntax)
+	def render_many(self, defaultranges = (None, ), arraysyntaxes = (None, ), memo = None, report = None):
+		outputs = {}
+		for arraysyntax in arraysyntaxes:
+			for defaultrange in defaultranges:
+				outputs[(defaultrange, arraysyntax)] = self.render(None, defaultrange, arraysyntax, memo, report)
+		return outputs
+
+	# The Parsed template for the array syntax, and with or without a default range
+	def parse(self, arraysyntax, ranged):
+		key = (arraysyntax, ranged)
+		with self._lock:
+			if key not in self._parsed:
+				self._parsed[key] = Parsed(self._tokens, arraysyntax, ranged, library.Includes(self.directory))
+			return self._parsed[key]
+
+
+class Parsed(object):
+
+	def __init__(self, tokens, arraysyntax, ranged, includes):
+		context = parser.ParsingContext(tokens)
+		context.settings = parser.Settings(arraysyntax = arraysyntax, includes = includes)
+
+		# the start and end of the default range
+		self.parameters = []
+		if ranged:
+			for name in ['RANGEMIN', 'RANGEMAX']:
+				parameter = num.Parameter(name)
+				parameter.slot = context.declare(name, parameter)
+				self.parameters.append(parameter)
+			context.settings = context.settings.replace(defaultrange = self.parameters)
+
+		try:
+			self.block = codegen.compile(context.parse())
+		except Exception, e:
+			parser.raise_with_position(e, context.iterator_stack)
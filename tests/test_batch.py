@@ -0,0 +1,111 @@
+import os
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diskcache
+import library
+import batch
+
+'''
+Checks that --batch only renders a template again when it, a file it includes or its output has changed
+'''
+
+template = '''@include[[ lib.grx ]]
+@iterate[[ i ]]
+	const double df`i` = @d1[[ f[[x#]], i, d1 ]];
+@end
+'''
+
+stencil = '''@defaultrange[[1,%d]]
+@arraysyntax[[C]]
+@stencil[[d1]]
+	@points[[  -1,   1   ]]
+	@weights[[ -0.5, 0.5 ]]
+@end
+'''
+
+
+class BatchTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.disk = diskcache.disk
+		diskcache.disk = diskcache.DiskCache(os.path.join(self.directory, 'cache'))
+		library.libraries.clear()
+		self.time = int(time.time())
+
+		self.infile = self.path('main.grx')
+		self.outfile = self.path('main.c')
+		self.write('main.grx', template)
+		self.write('lib.grx', stencil % 2)
+
+	def tearDown(self):
+		diskcache.disk = self.disk
+		library.libraries.clear()
+		shutil.rmtree(self.directory)
+
+	def path(self, name):
+		return os.path.join(self.directory, name)
+
+	# Write a file, with a later modification time than the last one even on a file system with coarse timestamps
+	def write(self, name, text):
+		with open(self.path(name), 'w') as f:
+			f.write(text)
+		self.time = self.time + 10
+		os.utime(self.path(name), (self.time, self.time))
+
+	def build(self):
+		return batch.build_file((self.infile, self.outfile))
+
+	def output(self):
+		with open(self.outfile) as f:
+			return f.read()
+
+	def test_up_to_date(self):
+		self.assertEqual(self.build(), ('written', None))
+		self.assertTrue('df2' in self.output() and 'df3' not in self.output())
+		self.assertEqual(self.build(), ('cached', None))
+
+		# only the digests matter, not the modification times
+		os.utime(self.infile, None)
+		self.assertEqual(self.build(), ('cached', None))
+
+		# an output changed by hand is put back
+		self.write('main.c', 'edited')
+		self.assertEqual(self.build(), ('written', None))
+		self.assertEqual(self.build(), ('cached', None))
+
+		# and one which was deleted
+		os.remove(self.outfile)
+		self.assertEqual(self.build(), ('written', None))
+
+	def test_include_changed(self):
+		self.assertEqual(self.build(), ('written', None))
+		self.write('lib.grx', stencil % 3)
+		self.assertEqual(self.build(), ('written', None))
+		self.assertTrue('df3' in self.output())
+		self.assertEqual(self.build(), ('cached', None))
+
+		# a nested include is an input too
+		self.write('lib.grx', '@include[[ nested.grx ]]\n')
+		self.write('nested.grx', stencil % 2)
+		self.assertEqual(self.build(), ('written', None))
+		self.write('nested.grx', stencil % 3)
+		self.assertEqual(self.build(), ('written', None))
+		self.assertTrue('df3' in self.output())
+
+		# a change which makes no difference to the output renders it again, but doesn't write it
+		self.write('nested.grx', (stencil % 3).replace('-0.5,', '-0.5,  '))
+		self.assertEqual(self.build(), ('unchanged', None))
+
+	def test_manifest(self):
+		self.write('manifest', 'main.grx main.c  # a comment\n\n# another\n')
+		self.assertEqual(batch.read_manifest(self.path('manifest')), [(self.infile, self.outfile)])
+
+
+if __name__ == '__main__':
+	unittest.main()
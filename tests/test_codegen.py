@@ -0,0 +1,64 @@
+import os
+import sys
+import glob
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lexer
+import parser
+import codegen
+import memo
+
+'''
+Checks that the templates in examples/ render the same through the tree-walking interpreter and the compiled render
+functions of codegen.py, with and without a memo, and as given in examples/*.out for those which have one
+'''
+
+examples = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', '*.grx')))
+
+
+# Render the template at path with codegen.render() and the options given
+def render(path, **options):
+	with open(path) as f:
+		return codegen.render(f, **options)
+
+
+class CodegenTest(unittest.TestCase):
+
+	def test_examples(self):
+		self.assertTrue(examples)
+		for path in examples:
+			expected = render(path, compiled = False)
+			self.assertTrue(expected.strip(), path)
+			self.assertEqual(render(path), expected, os.path.basename(path))
+			self.assertEqual(render(path, compiled = False, memo = memo.Memo()), expected, os.path.basename(path))
+			self.assertEqual(render(path, memo = memo.Memo()), expected, os.path.basename(path))
+			# a memo small enough to evict entries while rendering
+			self.assertEqual(render(path, memo = memo.Memo(4)), expected, os.path.basename(path))
+
+	# Where an example has an .out file next to it, the output has to be exactly that
+	def test_expected(self):
+		outputs = [path[:-len('.grx')] + '.out' for path in examples]
+		outputs = [path for path in outputs if os.path.exists(path)]
+		self.assertTrue(outputs)
+		for path in outputs:
+			with open(path) as f:
+				self.assertEqual(render(path[:-len('.out')] + '.grx'), f.read(), os.path.basename(path))
+
+	# A compiled block renders the same again, once its render function has been generated
+	def test_render_twice(self):
+		for path in examples:
+			with open(path) as f:
+				blocks = [codegen.compile(block) for block in parser.parse_stream(lexer.lex_stream(f))]
+			outputs = []
+			for i in range(2):
+				out = StringIO()
+				for block in blocks:
+					block.render(out)
+				outputs.append(out.getvalue())
+			self.assertEqual(outputs[0], outputs[1], path)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diskcache
+
+'''
+Checks where the disk cache lives, and that a cache which can't be written is given up on without leaving files behind
+'''
+
+class DiskCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.environ = dict(os.environ)
+
+	def tearDown(self):
+		os.environ.clear()
+		os.environ.update(self.environ)
+		shutil.rmtree(self.directory)
+
+	def files(self):
+		return sorted([os.path.join(path, name) for (path, directories, names) in os.walk(self.directory) for name in names])
+
+	def test_round_trip(self):
+		cache = diskcache.DiskCache(os.path.join(self.directory, 'cache'))
+		cache.put('test', ['a', 1], {'value': [1, 2]})
+		self.assertEqual(cache.get('test', ['a', 1]), {'value': [1, 2]})
+		self.assertEqual(cache.get('test', ['a', 2]), None)
+		self.assertEqual(len(self.files()), 1)
+
+	def test_default_directory(self):
+		os.environ['GRX_CACHE'] = '/grx/cache'
+		os.environ['XDG_CACHE_HOME'] = '/xdg'
+		self.assertEqual(diskcache.default_directory(), '/grx/cache')
+
+		del os.environ['GRX_CACHE']
+		self.assertEqual(diskcache.default_directory(), os.path.join('/xdg', 'grx'))
+
+		# relative paths in $XDG_CACHE_HOME are ignored
+		for value in ['', 'relative']:
+			os.environ['XDG_CACHE_HOME'] = value
+			os.environ['HOME'] = '/home/user'
+			self.assertEqual(diskcache.default_directory(), os.path.join('/home/user', '.cache', 'grx'))
+
+	# The directory can't be created, since a file is in the way
+	def test_unwritable_directory(self):
+		blocker = os.path.join(self.directory, 'file')
+		open(blocker, 'w').close()
+		cache = diskcache.DiskCache(os.path.join(blocker, 'cache'))
+
+		cache.put('test', ['a'], 1)
+		self.assertFalse(cache.writable)
+		self.assertEqual(cache.get('test', ['a']), None)
+		self.assertEqual(self.files(), [blocker])
+
+	# The temporary file is written but can't be renamed into place
+	def test_failed_rename(self):
+		cache = diskcache.DiskCache(self.directory)
+		os.makedirs(cache.path('test', ['a']))
+
+		cache.put('test', ['a'], 1)
+		self.assertFalse(cache.writable)
+		self.assertEqual(self.files(), [])
+
+		# later writes aren't attempted
+		cache.put('test', ['b'], 2)
+		self.assertEqual(cache.get('test', ['b']), None)
+		self.assertEqual(self.files(), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
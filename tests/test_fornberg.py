@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from fractions import Fraction
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diskcache
+import fornberg
+
+'''
+Checks the weights from Fornberg's algorithm against known central and one-sided finite difference coefficients
+'''
+
+def fractions(*weights):
+	return [Fraction(weight) for weight in weights]
+
+
+class FornbergTest(unittest.TestCase):
+
+	def test_central(self):
+		self.assertEqual(fornberg.compute(1, fractions(-1, 0, 1)), fractions('-1/2', 0, '1/2'))
+		self.assertEqual(fornberg.compute(2, fractions(-1, 0, 1)), fractions(1, -2, 1))
+		self.assertEqual(fornberg.compute(1, fractions(-2, -1, 0, 1, 2)), fractions('1/12', '-2/3', 0, '2/3', '-1/12'))
+		self.assertEqual(fornberg.compute(2, fractions(-2, -1, 0, 1, 2)), fractions('-1/12', '4/3', '-5/2', '4/3', '-1/12'))
+		self.assertEqual(fornberg.compute(4, fractions(-2, -1, 0, 1, 2)), fractions(1, -4, 6, -4, 1))
+		self.assertEqual(fornberg.compute(6, fractions(-3, -2, -1, 0, 1, 2, 3)), fractions(1, -6, 15, -20, 15, -6, 1))
+
+	def test_one_sided(self):
+		self.assertEqual(fornberg.compute(1, fractions(0, 1)), fractions(-1, 1))
+		self.assertEqual(fornberg.compute(1, fractions(0, 1, 2)), fractions('-3/2', 2, '-1/2'))
+		self.assertEqual(fornberg.compute(1, fractions(-2, -1, 0)), fractions('1/2', -2, '3/2'))
+		self.assertEqual(fornberg.compute(2, fractions(0, 1, 2, 3)), fractions(2, -5, 4, -1))
+
+	# The points don't have to be in order, or on the grid
+	def test_points(self):
+		self.assertEqual(fornberg.compute(1, fractions(1, -1, 0)), fractions('1/2', '-1/2', 0))
+		self.assertEqual(fornberg.compute(1, fractions('-1/2', '1/2')), fractions(-1, 1))
+		self.assertEqual(fornberg.compute(0, fractions(-1, 0, 1)), fractions(0, 1, 0))
+
+	def test_errors(self):
+		self.assertRaises(ValueError, fornberg.compute, 2, fractions(0, 1))
+		self.assertRaises(ValueError, fornberg.compute, 1, fractions(0, 1, 1))
+		self.assertRaises(ValueError, fornberg.compute, -1, fractions(0, 1))
+
+	# Weights read back from the disk cache are the same as those worked out
+	def test_disk_cache(self):
+		directory = tempfile.mkdtemp()
+		disk = diskcache.disk
+		try:
+			diskcache.disk = diskcache.DiskCache(directory)
+			expected = fornberg.compute(3, fractions(-2, -1, 0, 1, 2))
+			fornberg._weights.clear()
+			self.assertEqual(fornberg.weights(3, [-2, -1, 0, 1, 2]), expected)
+			fornberg._weights.clear()
+			self.assertEqual(fornberg.weights(3, ['-2', '-1', '0', '1', '2']), expected)
+			self.assertEqual(len(os.listdir(os.path.join(directory, 'fornberg'))), 1)
+		finally:
+			diskcache.disk = disk
+			fornberg._weights.clear()
+			shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''
+Checks the errors grx.py reports on its command line
+'''
+
+# Run grx.py with argv, returning its exit status and what it wrote to stderr
+def grx(argv):
+	process = subprocess.Popen([sys.executable, os.path.join(root, 'grx.py'), '--no-cache'] + argv,
+		stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+	err = process.communicate('')[1]
+	return (process.returncode, err)
+
+
+class ErrorTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	# An IOError has no message of its own, so the file and the reason are shown
+	def test_missing_file(self):
+		path = os.path.join(self.directory, 'missing.grx')
+		self.assertEqual(grx([path]), (1, path + ': No such file or directory\n'))
+
+		(status, err) = grx(['--batch', path, os.path.join(self.directory, 'out.c')])
+		self.assertEqual(status, 1)
+		self.assertTrue(err.startswith(path + ': '), err)
+		self.assertTrue(err.splitlines()[0].endswith(': No such file or directory'), err)
+
+	def test_template_error(self):
+		path = os.path.join(self.directory, 'error.grx')
+		with open(path, 'w') as f:
+			f.write('x;\n@d1[[ f, 1, missing ]]\n')
+		(status, err) = grx([path])
+		self.assertEqual(status, 1)
+		self.assertTrue(err.startswith('Error: 2:'), err)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import parser
+import codegen
+import diskcache
+import library
+
+'''
+Checks that a library brought in with @include renders the same whether it is parsed, kept in memory or read back
+from the disk cache, and that the disk cache entry is not used once a file it includes has changed
+'''
+
+template = '''@include[[ lib.grx ]]
+@iterate[[ i ]]
+	const double df`i` = @d1[[ f[[x#]], i, d1 ]] + 2 * @d1[[ f[[x#]], i, d1wide ]];
+@end
+'''
+
+lib = '''@include[[ nested.grx ]]
+@defaultrange[[1,%d]]
+@stencil[[d1wide]]
+	@derivative[[ 1, 4 ]]
+@end
+'''
+
+nested = '''@arraysyntax[[C]]
+@stencil[[d1]]
+	@points[[  -1,   1   ]]
+	@weights[[ %s, 0.5 ]]
+@end
+'''
+
+
+class LibraryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.disk = diskcache.disk
+		diskcache.disk = diskcache.DiskCache(os.path.join(self.directory, 'cache'))
+		library.libraries.clear()
+		self.time = int(time.time())
+
+		self.parsed = []
+		self.parse = library.parse
+		def parse(path, source, includes):
+			self.parsed.append(os.path.basename(path))
+			return self.parse(path, source, includes)
+		library.parse = parse
+
+		self.write('lib.grx', lib % 3)
+		self.write('nested.grx', nested % '-0.5')
+
+	def tearDown(self):
+		library.parse = self.parse
+		diskcache.disk = self.disk
+		library.libraries.clear()
+		shutil.rmtree(self.directory)
+
+	# Write a file, with a later modification time than the last one
+	def write(self, name, text):
+		path = os.path.join(self.directory, name)
+		with open(path, 'w') as f:
+			f.write(text)
+		self.time = self.time + 10
+		os.utime(path, (self.time, self.time))
+
+	def render(self):
+		includes = library.Includes(self.directory)
+		return codegen.render(StringIO(template), settings = parser.Settings(includes = includes))
+
+	def test_round_trip(self):
+		expected = self.render()
+		self.assertTrue('df3' in expected and '[x1 + (-2)]' in expected, expected)
+		self.assertEqual(self.parsed, ['lib.grx', 'nested.grx'])
+		self.assertEqual(len(os.listdir(os.path.join(self.directory, 'cache', 'include'))), 2)
+
+		# kept in memory for the rest of the run
+		self.assertEqual(self.render(), expected)
+		self.assertEqual(self.parsed, ['lib.grx', 'nested.grx'])
+
+		# and read back from the disk cache in a later one
+		library.libraries.clear()
+		self.assertEqual(self.render(), expected)
+		self.assertEqual(self.parsed, ['lib.grx', 'nested.grx'])
+
+	def test_nested_changed(self):
+		self.render()
+		self.write('nested.grx', nested % '-0.25')
+		library.libraries.clear()
+		output = self.render()
+		self.assertTrue('(-0.25)' in output, output)
+		# lib.grx itself is the same, but its entry records the digest of nested.grx
+		self.assertEqual(self.parsed, ['lib.grx', 'nested.grx', 'lib.grx', 'nested.grx'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import subprocess
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import codegen
+import looped
+import memo
+
+'''
+Checks the derivatives which --report lists for examples/unroll.grx, however the template is rendered
+'''
+
+path = os.path.join(root, 'tests', 'examples', 'unroll.grx')
+
+expected = '''11:26: @d2 looped with 9 terms, looped with 64 terms
+15:23: @d1 unrolled with 8 terms
+19:27: @d1 unrolled with 8 terms
+'''
+
+
+class ReportTest(unittest.TestCase):
+
+	def test_options(self):
+		for options in [[], ['--memoize'], ['--jobs=3']]:
+			argv = [sys.executable, os.path.join(root, 'grx.py'), '--no-cache', '--report'] + options + [path]
+			process = subprocess.Popen(argv, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+			err = process.communicate()[1]
+			self.assertEqual(process.returncode, 0, err)
+			lines = [line for line in err.splitlines(True) if not line.startswith('memo:')]
+			self.assertEqual(''.join(lines), expected, ' '.join(options))
+
+	# The @d1 at 19:27 is rendered once for each value of i and repeated for each value of j, see invariant.py
+	def test_render(self):
+		for (compiled, cache) in [(False, None), (True, None), (True, memo.Memo(4))]:
+			report = looped.Report()
+			with open(path) as f:
+				codegen.render(f, memo = cache, report = report, compiled = compiled)
+			self.assertEqual(''.join([line + '\n' for line in report.lines()]), expected)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import glob
+import threading
+import subprocess
+import unittest
+from cStringIO import StringIO
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import codegen
+
+'''
+Checks that rendering with --jobs, and parsing on several threads at once, gives byte for byte the same output as
+doing it serially
+'''
+
+examples = sorted(glob.glob(os.path.join(root, 'tests', 'examples', '*.grx')))
+
+# Many top level blocks, and top level @iterates long enough to be split into chunks
+template = '''@defaultrange[[1,3]]
+@arraysyntax[[C]]
+@stencil[[d1cen4]]
+	@points[[  -2,    -1,     1,     2      ]]
+	@weights[[ 1/12., -8/12., 8/12., -1/12. ]]
+@end
+@stencil[[d2cen4]]
+	@points[[  -2,     -1,    0,      1,    2      ]]
+	@weights[[ -1/12., 4/3., -5/2., 4/3., -1/12. ]]
+@end
+''' + ''.join('''
+block%d;
+@iterate[[ i, j=i.. ]]
+	const double ddf%d`i`j` = @d2[[ f[[x#]], i, j, d1cen4, d2cen4 ]];
+@end
+@iterate[[n=1..40]]
+	a%d`n` = @sum[[k]] b`k`n` @end;
+@end
+''' % (block, block, block) for block in range(20))
+
+
+# Run grx.py with the options given on the template, read from the file at path or, if path is None, from stdin
+def grx(options, path = None):
+	argv = [sys.executable, os.path.join(root, 'grx.py'), '--no-cache'] + options + [path or '-']
+	process = subprocess.Popen(argv, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+	(out, err) = process.communicate(None if path else template)
+	if process.returncode != 0:
+		raise Exception(' '.join(argv) + ' failed: ' + err)
+	return out
+
+# Call run(index) on count threads at once
+def run_threads(run, count = 8):
+	threads = [threading.Thread(target = run, args = (index, )) for index in range(count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+
+class ParallelTest(unittest.TestCase):
+
+	def test_stdin(self):
+		expected = grx([])
+		self.assertTrue(expected.count('\n') > 1000)
+		for jobs in [2, 3, 8]:
+			self.assertEqual(grx(['--jobs=%d' % jobs]), expected, '--jobs=%d' % jobs)
+		self.assertEqual(grx(['--jobs=4', '--memoize=16']), expected)
+
+	def test_files(self):
+		for path in examples:
+			expected = grx([], path)
+			for jobs in [2, 5]:
+				self.assertEqual(grx(['--jobs=%d' % jobs], path), expected, os.path.basename(path))
+
+	# Parsers on different threads don't share any state, see parser.ParsingContext
+	def test_threads(self):
+		texts = [template] + [open(path).read() for path in examples]
+		expected = [codegen.render(StringIO(text)) for text in texts]
+
+		results = {}
+		def run(index):
+			try:
+				results[index] = [codegen.render(StringIO(text)) for text in texts]
+			except Exception, e:
+				results[index] = e
+
+		run_threads(run)
+		for index in range(8):
+			self.assertEqual(results[index], expected)
+
+	# An error on one thread is reported with its own position
+	def test_thread_errors(self):
+		errors = {}
+		def run(index):
+			text = 'x;\n' * index + '@iterate[[ i ]] a`i` @end\n@d1[[ f, 1, missing ]]\n'
+			try:
+				codegen.render(StringIO('@defaultrange[[1,3]]\n' + text))
+			except Exception, e:
+				errors[index] = str(e)
+
+		run_threads(run)
+		for index in range(8):
+			self.assertTrue(errors[index].startswith('Error: %d:' % (index + 3)), errors[index])
+
+
+if __name__ == '__main__':
+	unittest.main()
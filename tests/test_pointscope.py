@@ -0,0 +1,57 @@
+import os
+import re
+import sys
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lexer
+import parser
+import codegen
+import iteration
+import parallel
+
+'''
+Checks that the temporaries of @pointscopes are declared once each in the whole output, however often the scopes are
+rendered
+'''
+
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', 'pointscope.grx')
+
+declaration = re.compile(r'^\s*(?:const )?double (\w+) =', re.M)
+
+
+class PointScopeTest(unittest.TestCase):
+
+	def test_unique_names(self):
+		with open(path) as f:
+			output = codegen.render(f)
+		names = declaration.findall(output)
+		self.assertEqual(len(names), len(set(names)), names)
+
+		# inside the @iterate, the second value of the counter numbers on from the first
+		self.assertTrue('const double grx_point6 = f2[x3][x2][x1 + (-1)];' in output)
+		# later scopes with the same prefix, in the same top level block or another one
+		self.assertTrue('const double grx_point1_0 = g[x3][x2][x1 + (-1)];' in output)
+		self.assertTrue('double grx_point2_0 = g[x3][x2][x1 + (-1)];' in output)
+		self.assertTrue('const double p0 = h[x3][x2][x1 + (-1)];' in output)
+		self.assertTrue('const double p1_0 = h[x3][x2 + (-1)][x1];' in output)
+
+	# A top level @iterate with a @pointscope inside is rendered whole, so --jobs gives the same names
+	def test_not_split(self):
+		with open(path) as f:
+			blocks = list(parser.parse_stream(lexer.lex_stream(f)))
+		(block, ) = [block for block in blocks if isinstance(block, iteration.IterationBlock)]
+		self.assertTrue(block.ordered)
+		self.assertEqual(parallel.chunks(block, 4), [None])
+
+		# one without is still shared out
+		template = '@defaultrange[[1,3]]\n@iterate[[n=1..40]]\n\ta`n`;\n@end\n'
+		blocks = parser.parse_stream(lexer.lex_stream(StringIO(template)))
+		(block, ) = [block for block in blocks if isinstance(block, iteration.IterationBlock)]
+		self.assertFalse(block.ordered)
+		self.assertTrue(len(parallel.chunks(block, 4)) > 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import grxc
+
+'''
+Checks that grxc.py, answered by a server started with grx.py --serve, gives the same output, errors and exit status
+as running grx.py directly
+'''
+
+examples = sorted(glob.glob(os.path.join(root, 'tests', 'examples', '*.grx')))
+
+
+class ServerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.environ = dict(os.environ)
+		self.environ['GRX_CACHE'] = os.path.join(self.directory, 'cache')
+		self.environ['GRX_SOCKET'] = os.path.join(self.directory, 'grx.sock')
+
+		argv = [sys.executable, os.path.join(root, 'grx.py'), '--serve']
+		self.server = subprocess.Popen(argv, env = self.environ, stderr = subprocess.PIPE)
+		for attempt in range(100):
+			if os.path.exists(self.environ['GRX_SOCKET']):
+				break
+			time.sleep(0.1)
+
+	def tearDown(self):
+		self.server.send_signal(signal.SIGINT)
+		self.server.communicate()
+		shutil.rmtree(self.directory)
+
+	# Run script with argv and the given input, returning its exit status, output and errors
+	def run_script(self, script, argv, source = ''):
+		process = subprocess.Popen([sys.executable, os.path.join(root, script)] + argv, env = self.environ,
+			stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = self.directory)
+		(out, err) = process.communicate(source)
+		return (process.returncode, out, err)
+
+	def assertSame(self, argv, source = ''):
+		expected = self.run_script('grx.py', argv, source)
+		self.assertEqual(self.run_script('grxc.py', argv, source), expected, ' '.join(argv))
+		return expected
+
+	def test_examples(self):
+		# the server is the one answering
+		grxc.connect(self.environ['GRX_SOCKET']).close()
+
+		for path in examples:
+			(status, out, err) = self.assertSame([path])
+			self.assertEqual(status, 0, err)
+			self.assertTrue(out.strip())
+			self.assertSame(['--memoize', '--report', path])
+
+	def test_stdin(self):
+		with open(examples[0]) as f:
+			source = f.read()
+		(status, out, err) = self.assertSame(['-'], source)
+		self.assertEqual(status, 0, err)
+
+	def test_errors(self):
+		(status, out, err) = self.assertSame(['-'], 'x;\n@d1[[ f, 1, missing ]]\n')
+		self.assertEqual(status, 1)
+		self.assertTrue(err.startswith('Error: 2:'), err)
+
+		(status, out, err) = self.assertSame(['missing.grx'])
+		self.assertEqual((status, err), (1, 'missing.grx: No such file or directory\n'))
+
+	# Files are read and written relative to the directory of the client
+	def test_batch(self):
+		shutil.copy(examples[0], os.path.join(self.directory, 'in.grx'))
+		self.assertEqual(self.run_script('grxc.py', ['--batch', 'in.grx', 'out.c'])[0], 0)
+		with open(os.path.join(self.directory, 'out.c')) as f:
+			self.assertEqual(f.read(), self.run_script('grx.py', ['in.grx'])[1])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codegen
+import substitution
+
+'''
+Checks that substitution.Definitions resolves chains of @defines whatever order they are made in, and rejects cycles
+'''
+
+def definitions(*pairs):
+	result = substitution.Definitions()
+	for (match, replace) in pairs:
+		result.add(match, replace)
+	return result
+
+
+class DefinitionsTest(unittest.TestCase):
+
+	def test_chain(self):
+		chain = definitions(('b', 'c'), ('a', 'b'))
+		self.assertEqual(chain.final('a'), 'c')
+		self.assertEqual(chain.final('b'), 'c')
+
+	# a -> b is resolved before b is defined, and has to be worked out again afterwards
+	def test_forward_chain(self):
+		chain = definitions(('a', 'b'))
+		self.assertEqual(chain.final('a'), 'b')
+		chain.add('b', 'c')
+		self.assertEqual(chain.final('a'), 'c')
+		chain.add('c', 'x + y')
+		self.assertEqual(chain.final('a'), 'x + y')
+		self.assertEqual(chain.final('b'), 'x + y')
+
+	def test_references(self):
+		chain = definitions(('s', 'a * a'), ('a', 'u + v'), ('u', 'w'))
+		self.assertEqual(chain.final('s'), '(w + v) * (w + v)')
+		# a name is only replaced as a whole token
+		self.assertEqual(definitions(('g1', 'h'), ('f', 'g12 + g1')).final('f'), 'g12 + h')
+
+	def test_cycles(self):
+		for pairs in [[('a', 'a + 1')], [('a', 'b'), ('b', 'a')], [('a', 'b'), ('b', 'c'), ('c', 'a')],
+				[('c', 'a'), ('b', 'c'), ('a', 'b * 2')]]:
+			chain = definitions(*pairs[:-1])
+			(match, replace) = pairs[-1]
+			with self.assertRaises(Exception) as raised:
+				chain.add(match, replace)
+			self.assertTrue(str(raised.exception).startswith('circular @define: ' + match + ' -> '), raised.exception)
+
+			# the rejected definition leaves the others as they were, so the name can still be defined
+			self.assertFalse(match in chain)
+			chain.add(match, 'z')
+			self.assertEqual(chain.final(pairs[0][0]), 'z')
+
+	# The error says where the @define which closes the cycle is
+	def test_cycle_position(self):
+		template = '@definescope\n@define[[A, B]]\nx;\n  @define[[B, A]]\nA\n@end[[definescope]]\n'
+		with self.assertRaises(Exception) as raised:
+			codegen.render(StringIO(template))
+		self.assertEqual(str(raised.exception), 'Error: 4:3: circular @define: B -> A -> B')
+
+
+if __name__ == '__main__':
+	unittest.main()
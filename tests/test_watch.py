@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codegen
+import watch
+
+'''
+Checks that editing a template under watch.Document gives the same output as rendering it from scratch
+'''
+
+template = '''@defaultrange[[1,3]]
+@arraysyntax[[C]]
+@iterate[[i]]
+	a`i`;
+@end
+@stencil[[D]]
+	@points[[ -1, 1 ]]
+	@weights[[ -0.5, 0.5 ]]
+@end
+x;
+@iterate[[j]]
+	b`j` = @d1[[ f[[x#]], j, D ]];
+@end
+'''
+
+
+class WatchTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.infile = os.path.join(self.directory, 'in.grx')
+		self.outfile = os.path.join(self.directory, 'out.c')
+		self.stderr = sys.stderr
+		sys.stderr = StringIO()
+
+	def tearDown(self):
+		sys.stderr = self.stderr
+		shutil.rmtree(self.directory)
+
+	# Apply each (old, new) replacement to text in turn, checking the output after each
+	def edit(self, text, replacements):
+		with open(self.infile, 'w') as f:
+			f.write(text)
+		document = watch.Document(self.infile, self.outfile)
+		document.update()
+
+		for (old, new) in replacements:
+			self.assertIn(old, text)
+			text = text.replace(old, new)
+			with open(self.infile, 'w') as f:
+				f.write(text)
+			document.update()
+			with open(self.outfile) as f:
+				self.assertEqual(f.read(), codegen.render(StringIO(text)) + '\n')
+
+	def test_edit_text(self):
+		self.edit(template, [('x;', 'y;'), ('a`i`;', 'c`i`;'), ('-0.5, 0.5', '-1, 1')])
+
+	def test_edit_settings(self):
+		self.edit(template, [('@defaultrange[[1,3]]', '@defaultrange[[1,2]]'), ('@arraysyntax[[C]]', '@arraysyntax[[F]]')])
+
+	# Another counter shifts the slots of everything declared after it, so the units after it can't be kept as they
+	# were parsed, nor can a later edit be parsed in their scope
+	def test_allocate_before_stencil(self):
+		self.edit(template, [('@iterate[[i]]\n\ta`i`;', '@iterate[[i, t]]\n\ta`i``t`;'), ('f[[x#]]', 'g[[x#]]')])
+
+	def test_remove_counter_before_stencil(self):
+		text = template.replace('@iterate[[i]]\n\ta`i`;', '@iterate[[i, t]]\n\ta`i``t`;')
+		self.edit(text, [('@iterate[[i, t]]\n\ta`i``t`;', '@iterate[[i]]\n\ta`i`;'), ('f[[x#]]', 'g[[x#]]')])
+
+
+if __name__ == '__main__':
+	unittest.main()
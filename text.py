@@ -1,6 +1,7 @@
 import re
 import lexer
 import parser
+import num
 
 
 def blockify(content):
@@ -21,21 +22,29 @@ class TextToken(lexer.AbstractToken):
 		self.text = text
 
 	def parse(self, context):
-		blocks = []
+		# strings and variables, in order
+		parts = []
+		literal = False
 
-		pieces = TextToken.split_regex.split(self.text)
-		for piece in pieces:
+		for piece in TextToken.split_regex.split(self.text):
 
 			var = context.getvar(piece)
 			if var is None:
-				if len(blocks) > 0 and isinstance(blocks[-1], TextBlock):
-					blocks[-1].append(TextToken.split_char).append(piece)
+				if literal:
+					parts[-1] = parts[-1] + TextToken.split_char + piece
 				else:
-					blocks.append(TextBlock(piece))
+					parts.append(piece)
+				literal = True
 			else:
-				blocks.append(var)
+				if not isinstance(var, num.AbstractNumber):
+					raise ValueError("'" + piece.strip() + "' cannot be used in text")
+				parts.append(var)
+				literal = False
 
-		return parser.BlockSequence(blocks)
+		if len(parts) == 1 and literal:
+			return TextBlock(parts[0])
+		else:
+			return TemplateBlock(parts)
 
 	def __repr__(self):
 		return '<TextToken>'
@@ -46,6 +55,8 @@ class TextToken(lexer.AbstractToken):
 
 class TextBlock(parser.AbstractBlock):
 
+	trivial = True
+
 	def __init__(self, content):
 		self.content = str(content)
 
@@ -53,9 +64,62 @@ class TextBlock(parser.AbstractBlock):
 		self.content = self.content + str(content)
 		return self
 
-	def execute(self):
+	def dependencies(self):
+		return frozenset()
+
+	def execute(self, frame):
 		return self.content
 
+	def write(self, out, frame):
+		out.write(self.content)
+
+	def compile(self, gen):
+		gen.literal(self.content)
+
+
+'''
+Text with references to variables, rendered with a single % format
+
+Constants are folded into the format string when the block is created, so only the iteration counters are looked up
+while rendering.
+'''
+class TemplateBlock(parser.AbstractBlock):
+
+	trivial = True
+
+	# parts is a list of strings and numbers
+	def __init__(self, parts):
+		formats = []
+		self.variables = []
+
+		for part in parts:
+			if isinstance(part, num.ConstantNumber):
+				part = part.execute(None)
+
+			if isinstance(part, basestring):
+				formats.append(part.replace('%', '%%'))
+			else:
+				formats.append('%s')
+				self.variables.append(part)
+
+		self.format = ''.join(formats)
+
+	def dependencies(self):
+		return parser.dependencies(self.variables)
+
+	def execute(self, frame):
+		return self.format % tuple([variable.numvalue(frame) for variable in self.variables])
+
+	def write(self, out, frame):
+		out.write(self.format % tuple([variable.numvalue(frame) for variable in self.variables]))
+
+	def compile(self, gen):
+		if len(self.variables) == 0:
+			gen.literal(self.format % ())
+		else:
+			values = [variable.compile_value(gen) for variable in self.variables]
+			gen.write('%r %% (%s, )' % (self.format, ', '.join(values)))
+
 
 class PlainStringContext(parser.ParsingContext):
 
@@ -0,0 +1,269 @@
+import os
+import sys
+import time
+import hashlib
+import bisect
+import lexer
+import parser
+import codegen
+import batch
+import digests
+import library
+from cStringIO import StringIO
+
+'''
+Keeps output files up to date with their templates while they are being edited
+
+The document is split into units, each the text parsed by one top level token: a run of text, a tag or a whole
+extended tag up to its @end. When the file changes, it is lexed and parsed again from the start of the first unit
+which changed, with the scope and settings put back the way they were before that unit, so everything before it is
+kept as it is. Parsing stops again at the first unit after the change which starts at the same line and column as
+before, in the same scope and settings, and the rest are kept as well.
+
+Keeping them relies on the slot table (see parser.Scope) being the same as when they were parsed, since their blocks
+and the scopes they were parsed in refer to variables by slot number. Declaring a name at the top level always gives
+the scope a new map of names, so a unit which sees the same map as before can only refer to slots it names, which
+must still hold the same variables, and slots allocated after it, by itself and the units after it. The units are
+therefore only kept when their names refer to the same variables and the table has reached the same size as before,
+and then the rest of the old table is put back after it (see reusable()). A change which allocates more or fewer
+slots, e.g. another counter in an @iterate, has every unit after it parsed again.
+
+A unit which yields a block is then only rendered if it, or any unit before it which changed the scope or settings
+(e.g. @stencil, @defaultrange or @arraysyntax), is different from the last time, and the output file is only written
+if it has changed. When a file brought in with @include changes, the whole document is parsed and rendered again.
+'''
+
+# Check the files every interval seconds and bring their outputs up to date
+def watch(pairs, interval = 0.2):
+	documents = [Document(infile, outfile) for (infile, outfile) in pairs]
+	for document in documents:
+		document.update()
+
+	print >> sys.stderr, 'grx: watching ' + str(len(documents)) + ' files, press Ctrl-C to stop'
+	try:
+		while True:
+			time.sleep(interval)
+			for document in documents:
+				if document.changed():
+					document.update()
+	except KeyboardInterrupt:
+		pass
+
+
+class Unit(object):
+
+	# state is the scope and settings the unit was parsed in, key identifies its output
+	def __init__(self, start, position, state, settings, block):
+		self.start = start
+		self.position = position
+		self.state = state
+		self.settings = settings
+		self.block = block
+		self.key = None
+
+
+class Document(object):
+
+	def __init__(self, infile, outfile):
+		self.infile = infile
+		self.outfile = outfile
+		self.stamp = None
+		self.text = ''
+		self.units = []
+		self.scope = parser.Scope()
+		self.includes = library.Includes(os.path.dirname(os.path.abspath(infile)))
+		# the output of each unit by its key
+		self.outputs = {}
+		# the modification time and size of each included file when it was last parsed
+		self.included = {}
+
+	def changed(self):
+		if self.included_changed():
+			return True
+		try:
+			status = os.stat(self.infile)
+		except OSError:
+			return False
+		return (status.st_mtime, status.st_size) != self.stamp
+
+	def included_changed(self):
+		for (path, stamp) in self.included.iteritems():
+			if library.stamp(path) != stamp:
+				return True
+		return False
+
+	def update(self):
+		begin = time.time()
+		try:
+			status = os.stat(self.infile)
+			self.stamp = (status.st_mtime, status.st_size)
+			with open(self.infile) as f:
+				text = f.read()
+
+			if self.included_changed():
+				# the output of any unit might depend on them
+				self.text = ''
+				self.units = []
+				self.outputs = {}
+				self.includes = library.Includes(self.includes.directory)
+				self.included = {}
+
+			(units, rendered) = self.build(text)
+
+		except Exception, e:
+			print >> sys.stderr, self.infile + ': ' + parser.error_message(e)
+			# nothing is known to have been parsed right, so the next update starts from the beginning
+			self.text = ''
+			self.units = []
+			return
+
+		output = ''.join([self.outputs[unit.key] for unit in units if unit.key is not None]) + '\n'
+		if digests.digest(output) != digests.file_digest(self.outfile):
+			batch.write(self.outfile, output)
+			written = 'written'
+		else:
+			written = 'unchanged'
+
+		print >> sys.stderr, 'grx: %s %s, %d of %d blocks rendered in %.3fs' % (self.outfile, written, rendered,
+			len([unit for unit in units if unit.block is not None]), time.time() - begin)
+
+	# Parse text again from the first unit which changed and render the blocks which need it, return the new units and
+	# the number of blocks rendered
+	def build(self, text):
+		prefix = common_prefix(self.text, text)
+		suffix = min(common_prefix(self.text[::-1], text[::-1]), len(self.text) - prefix, len(text) - prefix)
+		# old units starting in the unchanged text at the end, by where they start in the new text
+		delta = len(text) - len(self.text)
+		tail = {}
+		for (number, unit) in enumerate(self.units):
+			if unit.start >= len(self.text) - suffix:
+				tail[unit.start + delta] = number
+		# the unit holding the last character before the change, which might run on into it
+		first = 0
+		while first + 1 < len(self.units) and self.units[first + 1].start < prefix:
+			first = first + 1
+
+		# the slot table of the last parse, which the units kept from it refer to
+		old_slots = list(self.scope.slots)
+
+		if first < len(self.units):
+			start = self.units[first].start
+			self.scope.restore(self.units[first].state)
+			settings = self.units[first].settings
+		else:
+			start = 0
+			self.scope.restore((0, {}, None))
+			settings = parser.Settings(includes = self.includes)
+
+		lines = line_starts(text)
+		(line, char) = position(lines, start)
+		tokens = lexer.StreamLexer(StringIO(text[start:]))
+		(tokens.start_line, tokens.start_char) = (line, char)
+
+		units = self.units[:first]
+		context = parser.ParsingContext(tokens.tokens())
+		context.scope = self.scope
+		context.settings = settings
+		try:
+			context.tokens_iterator.start()
+			for token in context.tokens_iterator:
+				start = lines[token.line - 1] + token.char - 1
+				unit = Unit(start, (token.line, token.char), self.scope.state(), context.settings, None)
+
+				old = self.units[tail[start]] if start in tail else None
+				if old is not None and reusable(old, unit, old_slots, self.scope.slots):
+					# the rest of the units, and what they declare, are kept as they were
+					self.scope.slots[len(self.scope.slots):] = old_slots[len(self.scope.slots):]
+					for old in self.units[tail[start]:]:
+						old.start = old.start + delta
+						units.append(old)
+					break
+
+				try:
+					block = context.parse_token(token)
+				except parser.LeaveContext:
+					break
+				if isinstance(block, parser.AbstractBlock):
+					unit.block = block
+				units.append(unit)
+			context.tokens_iterator.stop()
+
+		except Exception, e:
+			parser.raise_with_position(e, context.iterator_stack)
+
+		# the key of a unit is its text and line and column, and the text of every unit before it which changed the scope or
+		# settings, which is all that its output can depend on
+		outputs = {}
+		rendered = 0
+		sha = hashlib.sha1()
+		for (number, unit) in enumerate(units):
+			end = units[number + 1].start if number + 1 < len(units) else len(text)
+			source = text[unit.start:end]
+
+			if unit.block is None:
+				sha.update(source + '\0')
+				continue
+
+			unit.key = (unit.position, source, sha.hexdigest())
+			if unit.key in self.outputs:
+				outputs[unit.key] = self.outputs[unit.key]
+			else:
+				out = StringIO()
+				codegen.compile(unit.block).render(out)
+				outputs[unit.key] = out.getvalue()
+				rendered = rendered + 1
+
+			if number + 1 < len(units):
+				(size, names, local) = units[number + 1].state
+				if names is not unit.state[1] or units[number + 1].settings is not unit.settings:
+					sha.update(source + '\0')
+
+		self.text = text
+		self.units = units
+		self.outputs = outputs
+		self.included = dict([(path, library.stamp(path)) for path in self.includes.files])
+		return (units, rendered)
+
+
+# Whether old, a unit from the last parse, can be kept in place of unit, which starts at the same place in the new
+# text, along with all the units after it. Both have to be parsed in the same settings and see the same names, and
+# the names have to refer to the same variables in old_slots, the slot table of the last parse, as in slots, the one
+# being parsed. The units after old refer to the slots past its state by number, so the new table must also have
+# reached the same size; the slots before that which aren't named can differ, since only the units which allocated
+# them while parsing a nested context use them.
+def reusable(old, unit, old_slots, slots):
+	(size, names, local) = unit.state
+	if old.position != unit.position or old.settings is not unit.settings:
+		return False
+	if old.state[0] != size or old.state[1] is not names or len(slots) != size or len(old_slots) < size:
+		return False
+	for slot in names.itervalues():
+		if slots[slot] is not old_slots[slot]:
+			return False
+	return True
+
+
+# The length of the longest common prefix of a and b
+def common_prefix(a, b):
+	(low, high) = (0, min(len(a), len(b)))
+	while low < high:
+		middle = (low + high + 1) // 2
+		if a[low:middle] == b[low:middle]:
+			low = middle
+		else:
+			high = middle - 1
+	return low
+
+# The offset at which each line of text starts
+def line_starts(text):
+	lines = [0]
+	i = text.find('\n')
+	while i >= 0:
+		lines.append(i + 1)
+		i = text.find('\n', i + 1)
+	return lines
+
+# The (line, char) of offset in text, from its line_starts()
+def position(lines, offset):
+	line = bisect.bisect_right(lines, offset)
+	return (line, offset - lines[line - 1] + 1)